@@ -0,0 +1,289 @@
+# coding: utf-8
+
+# # Benchmarks at synthetic scale
+#
+# all_data.csv has 96 rows, which says nothing about how the pipeline behaves on full WHO /
+# World Bank extracts. This harness writes synthetic panels with the same schema
+# (Country, Year, Life expectancy at birth (years), GDP) at 10^3 to 10^8 rows and times
+# ingestion, the rename/normalise steps, the GDPinTrillions derivation, the per-country
+# summary (in memory and queried from Parquet, see query.py), handing the prepared frame to a
+# worker process (pickled, or through shared memory, see shared.py), drawing each kind of
+# figure and saving it. Results are saved as JSON so two revisions can be compared:
+#
+#   python benchmark.py --sizes 1e3,1e4,1e5,1e6
+#   python benchmark.py --sizes 1e3,1e4,1e5,1e6 --compare benchmark_results/<older>.json
+#
+# Cold start is timed too, in fresh interpreters: importing the entry point, and a
+# statistics-only run. The run fails if the import loads the plotting libraries, or takes
+# longer than --max-import-s. So is the fixed cost of a figure (style, figure, axes, text and
+# a draw, on a few rows), with a new figure each time and with reused templates.
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+from importlib import metadata
+
+import numpy as np
+import pandas as pd
+
+import life_expectancy_gdp as pipeline
+import query
+from countries import canonicalise_countries
+from data_loader import LEABY_COLUMN, load_all_data
+from render import render_figure, style_scope
+from shared import SharedData, attach
+from summary import summarise
+from templates import Templates
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "benchmark_results")
+
+# A few real names (so the USA alias has work to do), padded with synthetic ones
+REAL_COUNTRIES = ["Chile", "China", "Germany", "Mexico", "United States of America", "Zimbabwe"]
+N_COUNTRIES = 190
+FIRST_YEAR, N_YEARS = 1960, 60
+
+# Modules the entry point must not import at start-up: they load with the first render
+LAZY_MODULES = ["matplotlib.pyplot", "matplotlib.backends.backend_agg", "seaborn"]
+
+# Figures drawn per size, by kind; drawing is skipped above --render-max-rows
+FIGURES = {
+    "barplot": pipeline.STEP5_GDP,
+    "violinplot": pipeline.STEP6_VIOLIN,
+    "lineplot": pipeline.BLOG_FIGURES[1],
+    "facetgrid": pipeline.STEP8_SCATTER,
+}
+
+
+def synthetic_chunk(start, stop, seed=0):
+    """Rows `start` to `stop` of the synthetic panel. Row i always gets the same values."""
+    rows = np.arange(start, stop)
+    country = rows % N_COUNTRIES
+    year = FIRST_YEAR + (rows // N_COUNTRIES) % N_YEARS
+    rng = np.random.default_rng([seed, start])
+    base_life = 45 + (country * 37 % 35)
+    base_gdp = 10.0 ** (9 + (country * 13 % 50) / 12.0)
+    names = np.array(REAL_COUNTRIES + ["Country %03d" % i for i in range(len(REAL_COUNTRIES), N_COUNTRIES)])
+    return pd.DataFrame({
+        "Country": names[country],
+        "Year": year,
+        LEABY_COLUMN: np.round(base_life + 0.25 * (year - FIRST_YEAR) + rng.normal(0, 0.5, len(rows)), 1),
+        "GDP": base_gdp * 1.03 ** (year - FIRST_YEAR) * (1 + rng.normal(0, 0.02, len(rows))),
+    })
+
+
+def synthetic_csv(n_rows, workdir, chunk_rows=1000000):
+    """Path of a synthetic CSV with `n_rows` rows, written in chunks on first use."""
+    path = os.path.join(workdir, "synthetic_%d.csv" % n_rows)
+    if not os.path.exists(path):
+        tmp = path + ".tmp"
+        for start in range(0, n_rows, chunk_rows):
+            chunk = synthetic_chunk(start, min(start + chunk_rows, n_rows))
+            chunk.to_csv(tmp, mode="a" if start else "w", header=not start, index=False)
+        os.replace(tmp, path)
+    return path
+
+
+def best_of(function, repeat):
+    """Smallest wall time of `repeat` calls, and the last result."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_size(n_rows, workdir, repeat, render_max_rows, out_dir):
+    """Time every benchmark at one size; returns a list of result records."""
+    path = synthetic_csv(n_rows, workdir)
+    results = []
+
+    def record(name, seconds):
+        results.append({"rows": n_rows, "benchmark": name, "seconds": round(seconds, 6),
+                        "rows_per_s": round(n_rows / seconds, 1) if seconds > 0 else None})
+        print("%12d  %-22s %10.4f s" % (n_rows, name, seconds), file=sys.stderr)
+
+    # Ingestion: the original untyped read, the typed read, and the memory-mapped cache
+    seconds, raw = best_of(lambda: pd.read_csv(path), repeat)
+    record("read_csv", seconds)
+    seconds, _ = best_of(lambda: load_all_data(path, cache=False), repeat)
+    record("load_typed", seconds)
+    load_all_data(path)  # writes the cache
+    seconds, df = best_of(lambda: load_all_data(path), repeat)
+    record("load_cached", seconds)
+
+    # Rename/replace: the original regex replace on the untyped frame vs the alias map
+    seconds, _ = best_of(lambda: raw.rename(columns={LEABY_COLUMN: "LEABY"}), repeat)
+    record("rename", seconds)
+    seconds, _ = best_of(lambda: raw.replace(to_replace="United States of America", value="USA", regex=True), repeat)
+    record("replace_regex", seconds)
+    seconds, _ = best_of(lambda: canonicalise_countries(df.copy(deep=False)), repeat)
+    record("canonicalise", seconds)
+
+    # GDPinTrillions
+    seconds, _ = best_of(lambda: df["GDP"] / 1000000000000, repeat)
+    record("derive_gdp_trillions", seconds)
+
+    # Per-country summary (normal-approximation CI): in memory, and queried from a Parquet copy
+    seconds, _ = best_of(lambda: summarise(pipeline.normalise(df), ["Country"], ["GDPinTrillions", "LEABY"],
+                                           n_boot=0), repeat)
+    record("summary_in_memory", seconds)
+    for engine in query.available_engines():
+        source = query.open_source(path, engine)
+        seconds, _ = best_of(lambda: source.summary(["Country"]), repeat)
+        record("summary_query_" + engine, seconds)
+
+    # Handing df2 to a worker: a pickle round trip vs publishing and attaching a shared segment
+    df2 = pipeline.normalise(df)
+    seconds, _ = best_of(lambda: pickle.loads(pickle.dumps(df2, pickle.HIGHEST_PROTOCOL)), repeat)
+    record("handoff_pickle", seconds)
+
+    def handoff_shared():
+        with SharedData.publish(df2) as shared:
+            attach(shared.handle).close()
+    seconds, _ = best_of(handoff_shared, repeat)
+    record("handoff_shared", seconds)
+
+    # Figures: drawing and savefig, timed separately
+    if n_rows <= render_max_rows:
+        for name, spec in FIGURES.items():
+            seconds, fig = best_of(lambda: render_figure(spec, df2), repeat)
+            record(name, seconds)
+            target = os.path.join(out_dir, "benchmark_%s.png" % name)
+            seconds, _ = best_of(lambda: fig.savefig(target), repeat)
+            record(name + "_savefig", seconds)
+    return results
+
+
+def figure_overhead(repeat, n_figures=50):
+    """Per-figure seconds to style, build and draw the single-axes figures from a few rows.
+
+    Timed with a new Figure for each (`figure_new`) and on reused templates (`figure_template`).
+    """
+    tiny = pipeline.normalise(synthetic_chunk(0, 12).astype({"Country": "category"}))
+    specs = [spec for spec in pipeline.EXPLORATORY_FIGURES + pipeline.BLOG_FIGURES if spec.facet is None]
+
+    def draw_all(templates):
+        for i in range(n_figures):
+            spec = specs[i % len(specs)]
+            with style_scope(spec):
+                render_figure(spec, tiny, templates).canvas.draw()
+
+    results = []
+    for name, templates in [("figure_new", lambda: None), ("figure_template", Templates)]:
+        seconds, _ = best_of(lambda: draw_all(templates()), repeat)
+        results.append({"rows": len(tiny), "benchmark": name, "seconds": round(seconds / n_figures, 6),
+                        "rows_per_s": None})
+        print("%12s  %-22s %10.4f s" % ("-", name, seconds / n_figures), file=sys.stderr)
+    return results
+
+
+def startup(workdir, repeat):
+    """Cold-start records, each in a fresh interpreter, and the lazy modules the import loaded."""
+    probe = ("import json, sys, life_expectancy_gdp; "
+             "print(json.dumps(sorted(set(sys.modules) & set(%r))))" % LAZY_MODULES)
+    stats_only = ["life_expectancy_gdp.py", "--data", synthetic_csv(1000, workdir), "--out-dir", workdir,
+                  "--stages", "aggregate", "--report", "-"]
+    runs = {"startup_import": ["-c", probe], "startup_stats_only": stats_only}
+
+    results = []
+    loaded = []
+    for name, args in runs.items():
+        seconds, done = best_of(lambda: subprocess.run([sys.executable] + args, cwd=HERE, capture_output=True,
+                                                       text=True, check=True), repeat)
+        if name == "startup_import":
+            loaded = json.loads(done.stdout)
+        results.append({"rows": 0, "benchmark": name, "seconds": round(seconds, 6), "rows_per_s": None})
+        print("%12s  %-22s %10.4f s" % ("-", name, seconds), file=sys.stderr)
+    return results, loaded
+
+
+def environment():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = "unknown"
+    libraries = {}
+    for library in ["numpy", "pandas", "matplotlib", "seaborn", "pyarrow"]:
+        try:
+            libraries[library] = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            libraries[library] = None
+    return {
+        "revision": revision,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "libraries": libraries,
+    }
+
+
+def compare(old, new):
+    """Print old vs new seconds for every (rows, benchmark) present in both."""
+    before = {(r["rows"], r["benchmark"]): r["seconds"] for r in old["results"]}
+    print("%12s  %-22s %10s %10s %8s" % ("rows", "benchmark", old["revision"], new["revision"], "ratio"))
+    for r in new["results"]:
+        key = (r["rows"], r["benchmark"])
+        if key in before and before[key] > 0:
+            print("%12d  %-22s %10.4f %10.4f %7.2fx" % (key + (before[key], r["seconds"], r["seconds"] / before[key])))
+
+
+def sizes(text):
+    return [int(float(size)) for size in text.split(",") if size.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the pipeline on synthetic panels.")
+    parser.add_argument("--sizes", type=sizes, default=sizes("1e3,1e4,1e5,1e6"),
+                        help="comma-separated row counts, 1e3 to 1e8 (default: 1e3,1e4,1e5,1e6)")
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs (default: 3)")
+    parser.add_argument("--render-max-rows", type=float, default=1e6,
+                        help="skip figure benchmarks above this size (default: 1e6)")
+    parser.add_argument("--workdir", default=os.path.join(HERE, ".benchmark_data"),
+                        help="where synthetic CSVs are kept between runs")
+    parser.add_argument("--output", default=None, help="results JSON (default: benchmark_results/<rev>-<time>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    parser.add_argument("--max-import-s", type=float, default=None,
+                        help="fail if importing the entry point takes longer than this")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    report = environment()
+    report["results"], report["lazy_modules_loaded"] = startup(args.workdir, args.repeat)
+    report["results"].extend(figure_overhead(args.repeat))
+    for n_rows in args.sizes:
+        report["results"].extend(run_size(n_rows, args.workdir, args.repeat, args.render_max_rows, args.workdir))
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, "%s-%s.json" % (report["revision"], time.strftime("%Y%m%d-%H%M%S")))
+    with open(output, "w") as handle:
+        json.dump(report, handle, indent=2)
+        handle.write("\n")
+    print("Results saved to %s" % output, file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(json.load(handle), report)
+
+    if report["lazy_modules_loaded"]:
+        raise SystemExit("Importing the entry point loads %s; they should load on the first render"
+                         % ", ".join(report["lazy_modules_loaded"]))
+    import_s = report["results"][0]["seconds"]
+    if args.max_import_s is not None and import_s > args.max_import_s:
+        raise SystemExit("Importing the entry point took %.3f s (limit %.3f s)" % (import_s, args.max_import_s))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# coding: utf-8
+
+# # Change over time
+#
+# Step 7 asks which countries' bars change the most, which years have the biggest changes and
+# which country changed least, and those were answered by eye from the grouped bar charts.
+# This module computes the answers for every country and measure at once:
+# year-over-year deltas and percentage changes, the change and percentage change from the
+# first to the last year with data, and the compound annual growth rate (CAGR).
+#
+# As in correlation.py, each measure is a (country x year) array from a `panel.Panel`, with
+# NaN for missing years, so every statistic is one NumPy expression over the whole panel.
+# Rankings use `np.argpartition`, which finds the top k in linear time, and then sort only
+# those k.
+
+import numpy as np
+import pandas as pd
+
+from panel import as_panel
+
+
+def year_over_year(values):
+    """Change and percentage change from the year before, same shape as `values`.
+
+    The first year, and any year or year before it that is missing, is NaN.
+    """
+    delta = np.full(values.shape, np.nan)
+    percent = np.full(values.shape, np.nan)
+    delta[:, 1:] = values[:, 1:] - values[:, :-1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        percent[:, 1:] = 100 * delta[:, 1:] / np.abs(values[:, :-1])
+    return delta, percent
+
+
+def first_last(values):
+    """Column of the first and last non-NaN value per row (-1 for an empty row)."""
+    present = ~np.isnan(values)
+    any_present = present.any(axis=1)
+    first = np.where(any_present, np.argmax(present, axis=1), -1)
+    last = np.where(any_present, values.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1), -1)
+    return first, last
+
+
+def overall_change(values, years):
+    """Per row: first/last year with data, their values, change, percentage change and CAGR."""
+    first, last = first_last(values)
+    rows = np.arange(len(values))
+    empty = first < 0
+    start = np.where(empty, np.nan, values[rows, first])
+    end = np.where(empty, np.nan, values[rows, last])
+    span = np.where(empty, np.nan, years[last] - years[first])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        change = end - start
+        percent = 100 * change / np.abs(start)
+        # CAGR is only defined for positive values over at least one year
+        cagr = np.where((start > 0) & (end > 0) & (span > 0), 100 * ((end / start) ** (1 / span) - 1), np.nan)
+    return {
+        "first_year": np.where(empty, np.nan, years[first]),
+        "last_year": np.where(empty, np.nan, years[last]),
+        "first": start,
+        "last": end,
+        "change": change,
+        "pct_change": percent,
+        "cagr_pct": cagr,
+    }
+
+
+def top_k(values, k, largest=True):
+    """Positions of the `k` largest (or smallest) non-NaN values of a 1-D array, best first."""
+    values = np.asarray(values, dtype=np.float64)
+    candidates = np.flatnonzero(~np.isnan(values))
+    k = min(k, len(candidates))
+    if k == 0:
+        return candidates[:0]
+    keyed = -values[candidates] if largest else values[candidates]
+    picked = candidates[np.argpartition(keyed, k - 1)[:k]] if k < len(candidates) else candidates
+    order = np.argsort(-values[picked] if largest else values[picked], kind="stable")
+    return picked[order]
+
+
+def change_summary(data, measures=("GDP", "LEABY")):
+    """Tidy frame, one row per country and measure, of the first-to-last-year changes.
+
+    Columns: Country, measure, first_year, last_year, first, last, change, pct_change,
+    cagr_pct, the largest year-over-year rise and fall (with their years) and the mean
+    absolute year-over-year percentage change. `data` is a Panel or a long-format frame.
+    """
+    panel = as_panel(data, measures)
+    years = panel.years
+    frames = []
+    for measure in measures:
+        values = panel[measure]
+        delta, percent = year_over_year(values)
+        overall = overall_change(values, years)
+        has_delta = ~np.isnan(delta).all(axis=1)
+        rise = np.argmax(np.where(np.isnan(delta), -np.inf, delta), axis=1)
+        fall = np.argmin(np.where(np.isnan(delta), np.inf, delta), axis=1)
+        rows = np.arange(len(values))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_abs_pct = np.nansum(np.abs(percent), axis=1) / np.sum(~np.isnan(percent), axis=1)
+        frame = pd.DataFrame({"Country": np.asarray(panel.countries), "measure": measure})
+        for name, column in overall.items():
+            frame[name] = column
+        frame["largest_rise"] = np.where(has_delta, delta[rows, rise], np.nan)
+        frame["largest_rise_year"] = np.where(has_delta, years[rise], np.nan)
+        frame["largest_fall"] = np.where(has_delta, delta[rows, fall], np.nan)
+        frame["largest_fall_year"] = np.where(has_delta, years[fall], np.nan)
+        frame["mean_abs_yoy_pct"] = mean_abs_pct
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def rank_changes(summary, column="pct_change", k=5, largest=True, measure=None, absolute=False):
+    """The `k` rows of a `change_summary` with the largest (or smallest) `column`.
+
+    `absolute=True` ranks by size whatever the sign: the least changed country is
+    `rank_changes(summary, "pct_change", k=1, largest=False, absolute=True)`.
+    """
+    if measure is not None:
+        summary = summary[summary["measure"] == measure]
+    values = summary[column].to_numpy(dtype=np.float64)
+    if absolute:
+        values = np.abs(values)
+    return summary.iloc[top_k(values, k, largest)].reset_index(drop=True)
+
+
+def largest_yearly_changes(data, measures=("GDP", "LEABY"), k=10, percent=True):
+    """For each measure, the `k` (country, year) pairs with the biggest year-over-year change.
+
+    Ranks the size of the percentage change by default (`percent=False` for the raw change)
+    over the whole panel at once. Tidy frame: Country, Year, measure, change, pct_change.
+    """
+    panel = as_panel(data, measures)
+    countries = np.asarray(panel.countries)
+    frames = []
+    for measure in measures:
+        delta, pct = year_over_year(panel[measure])
+        ranked = pct if percent else delta
+        rows, columns = np.unravel_index(top_k(np.abs(ranked).ravel(), k), ranked.shape)
+        frames.append(pd.DataFrame({
+            "Country": countries[rows],
+            "Year": panel.years[columns],
+            "measure": measure,
+            "change": delta[rows, columns],
+            "pct_change": pct[rows, columns],
+        }))
+    return pd.concat(frames, ignore_index=True)
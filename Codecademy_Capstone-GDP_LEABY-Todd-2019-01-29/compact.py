@@ -0,0 +1,104 @@
+# coding: utf-8
+
+# # Compact working frame
+#
+# The notebook's `df2` had Country as Python strings, Year as int64, every measure as float64
+# and GDPinTrillions materialised next to GDP, although it is only GDP / 1e12. `compact`
+# gives the same rows with a categorical Country, the narrowest integer Year, float32
+# measures and no unit-scaled copies: GDPinTrillions is worked out from GDP when something
+# reads it (`measure_values` for the summaries and panel, a tick formatter for the raw-point
+# figures, see plots.ScaledFormatter). `memory_report` shows the bytes saved per column.
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+# Measures that are a stored column in other units: name -> (stored column, divisor)
+SCALED_MEASURES = {"GDPinTrillions": ("GDP", 1e12)}
+
+
+def stored_measure(df, measure):
+    """The column holding `measure` in `df` and the divisor to apply to it.
+
+    A measure that is in `df` is read as is (divisor 1). A scaled measure that isn't is read
+    from its stored column.
+    """
+    if measure not in df and measure in SCALED_MEASURES:
+        column, scale = SCALED_MEASURES[measure]
+        if column in df:
+            return column, scale
+    return measure, 1
+
+
+def has_measure(df, measure):
+    return stored_measure(df, measure)[0] in df
+
+
+def measure_values(df, measure, dtype=np.float64):
+    """Values of `measure` as a NumPy array, scaled from its stored column if need be."""
+    column, scale = stored_measure(df, measure)
+    values = df[column].to_numpy(dtype=dtype)
+    return values / scale if scale != 1 else values
+
+
+def narrowest_int(values):
+    """Smallest signed integer dtype holding every value."""
+    low, high = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return np.int64
+
+
+def compact(df):
+    """Copy of long-format `df` with the compact dtypes and no unit-scaled columns."""
+    columns = {}
+    for name, column in df.items():
+        if name in SCALED_MEASURES and SCALED_MEASURES[name][0] in df:
+            continue
+        if name == "Country" or column.dtype == object or pd.api.types.is_string_dtype(column.dtype):
+            columns[name] = column.astype("category")
+        elif pd.api.types.is_integer_dtype(column.dtype):
+            columns[name] = column.astype(narrowest_int(column.to_numpy()))
+        elif pd.api.types.is_float_dtype(column.dtype):
+            columns[name] = column.astype(np.float32)
+        else:
+            columns[name] = column
+    return pd.DataFrame(columns, index=df.index)
+
+
+def notebook_bytes(df):
+    """Bytes per column `df` would take in the notebook's layout (what plain read_csv gives).
+
+    Strings as Python objects, 8-byte numbers, and the scaled measures materialised. Worked
+    out from the distinct values and their counts, without building that frame.
+    """
+    sizes = {}
+    for name, column in df.items():
+        if not pd.api.types.is_numeric_dtype(column.dtype):
+            counts = column.value_counts(sort=False)
+            string_sizes = np.array([sys.getsizeof(str(value)) for value in counts.index], dtype=np.int64)
+            sizes[name] = 8 * len(column) + int(counts.to_numpy() @ string_sizes)
+        else:
+            sizes[name] = 8 * len(column)
+    for name, (column, _) in SCALED_MEASURES.items():
+        if name not in df and column in df:
+            sizes[name] = 8 * len(df)
+    return sizes
+
+
+def memory_report(df):
+    """Bytes per column of `df` against the notebook layout, with a total row."""
+    before = notebook_bytes(df)
+    after = df.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({
+        "notebook_bytes": pd.Series(before),
+        "bytes": pd.Series({name: int(after.get(name, 0)) for name in before}),
+    })
+    report["saved_bytes"] = report["notebook_bytes"] - report["bytes"]
+    report.loc["total"] = report.sum()
+    report.index.name = "column"
+    return report
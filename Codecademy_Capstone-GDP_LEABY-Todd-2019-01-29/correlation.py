@@ -0,0 +1,152 @@
+# coding: utf-8
+
+# # GDP and life expectancy correlation
+#
+# "Is there a correlation between GDP and life expectancy?" was answered by eye from the
+# Step 8 scatter plots. This module puts numbers on it for every country at once:
+# Pearson and Spearman r, the slope of life expectancy on log10(GDP), and a rolling-window
+# Pearson r, per country and pooled over all countries.
+#
+# GDP and LEABY come from the (country x year) arrays of a `panel.Panel`, with NaN for missing
+# years, so every statistic is a masked NumPy reduction along the year axis, with no
+# per-country loop.
+
+import numpy as np
+import pandas as pd
+
+from panel import as_panel
+
+
+def pairwise(x, y):
+    """Copies of `x` and `y` with NaN wherever either one is missing."""
+    missing = np.isnan(x) | np.isnan(y)
+    return np.where(missing, np.nan, x), np.where(missing, np.nan, y)
+
+
+def row_mean(values):
+    """Mean of the non-NaN values along the last axis (NaN for an empty row, no warning)."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nansum(values, axis=-1, keepdims=True) / np.sum(~np.isnan(values), axis=-1, keepdims=True)
+
+
+def pearson(x, y):
+    """Pearson r of each row of `x` against the same row of `y` (complete pairs only)."""
+    x, y = pairwise(x, y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dx = x - row_mean(x)
+        dy = y - row_mean(y)
+        return np.nansum(dx * dy, axis=-1) / np.sqrt(np.nansum(dx ** 2, axis=-1) * np.nansum(dy ** 2, axis=-1))
+
+
+def rank_rows(values):
+    """Average ranks (1-based, ties averaged) within each row; NaN stays NaN."""
+    values = np.atleast_2d(values)
+    n_rows, n_cols = values.shape
+    order = np.argsort(values, axis=1, kind="stable")  # NaNs sort last
+    ordered = np.take_along_axis(values, order, axis=1).ravel()
+
+    # Runs of equal values within a row share the average of their positions
+    row = np.repeat(np.arange(n_rows), n_cols)
+    new_run = np.ones(len(ordered), dtype=bool)
+    new_run[1:] = (ordered[1:] != ordered[:-1]) | (row[1:] != row[:-1])
+    run = np.cumsum(new_run) - 1
+    run_start = np.flatnonzero(new_run)
+    run_end = np.append(run_start[1:], len(ordered))
+    position = np.arange(len(ordered)) - row * n_cols
+    average = (position[run_start] + position[run_end - 1]) / 2.0 + 1
+
+    ranks = np.empty_like(values, dtype=np.float64)
+    np.put_along_axis(ranks, order, average[run].reshape(n_rows, n_cols), axis=1)
+    ranks[np.isnan(values)] = np.nan
+    return ranks
+
+
+def spearman(x, y):
+    """Spearman r per row: Pearson r of the within-row ranks of the complete pairs."""
+    x, y = pairwise(x, y)
+    return pearson(rank_rows(x), rank_rows(y))
+
+
+def slope(x, y):
+    """Least-squares slope and intercept of `y` on `x`, per row."""
+    x, y = pairwise(x, y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = row_mean(x)
+        mean_y = row_mean(y)
+        b = np.nansum((x - mean_x) * (y - mean_y), axis=-1) / np.nansum((x - mean_x) ** 2, axis=-1)
+    return b, mean_y[..., 0] - b * mean_x[..., 0]
+
+
+def rolling_pearson(x, y, window, pooled=False):
+    """Pearson r over trailing `window`-year windows, per row: same shape as `x`.
+
+    Window sums come from cumulative sums along the year axis, so the cost doesn't depend
+    on the window length. With `pooled`, the rows' window sums are added up, giving one row
+    of r over every country-year in each window. Windows with fewer than 3 complete pairs
+    are NaN.
+    """
+    x, y = pairwise(x, y)
+    # Centre first so the running sums don't lose precision (on a common mean when pooled)
+    rows = (1, -1) if pooled else x.shape
+    x = x - row_mean(x.reshape(rows))
+    y = y - row_mean(y.reshape(rows))
+    present = ~np.isnan(x)
+    x, y = np.where(present, x, 0), np.where(present, y, 0)
+
+    def window_sum(values):
+        total = np.cumsum(values, axis=1)
+        total[:, window:] = total[:, window:] - total[:, :-window]
+        return total.sum(axis=0, keepdims=True) if pooled else total
+
+    n = window_sum(present.astype(np.float64))
+    sx, sy = window_sum(x), window_sum(y)
+    sxx, syy, sxy = window_sum(x * x), window_sum(y * y), window_sum(x * y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+    r[n < 3] = np.nan
+    return np.clip(r, -1, 1)
+
+
+def correlation_rows(labels, gdp, leaby):
+    """One tidy row per matrix row: n, Pearson r, Spearman r, slope on log10(GDP)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_gdp = np.where(gdp > 0, np.log10(gdp), np.nan)
+    log_slope, log_intercept = slope(log_gdp, leaby)
+    return pd.DataFrame({
+        "Country": list(labels),
+        "n": np.sum(~np.isnan(gdp) & ~np.isnan(leaby), axis=1),
+        "pearson_r": pearson(gdp, leaby),
+        "spearman_r": spearman(gdp, leaby),
+        "log_gdp_slope": log_slope,
+        "log_gdp_intercept": log_intercept,
+    })
+
+
+def correlations(data, x="GDP", y="LEABY", pooled_label="All countries"):
+    """Tidy frame with one row per country plus a pooled row (all country-years together).
+
+    `data` is a Panel or a long-format frame like `df2`.
+    """
+    panel = as_panel(data, [x, y])
+    gdp, leaby = panel[x], panel[y]
+    per_country = correlation_rows(panel.countries, gdp, leaby)
+    pooled = correlation_rows([pooled_label], gdp.reshape(1, -1), leaby.reshape(1, -1))
+    return pd.concat([per_country, pooled], ignore_index=True)
+
+
+def rolling_correlations(data, window=5, x="GDP", y="LEABY", pooled_label="All countries"):
+    """Tidy frame of trailing `window`-year Pearson r: Country, Year (window end), rolling_r.
+
+    After the countries come the pooled rows, over all country-years of each window.
+    """
+    panel = as_panel(data, [x, y])
+    r = np.vstack([rolling_pearson(panel[x], panel[y], window),
+                   rolling_pearson(panel[x], panel[y], window, pooled=True)])
+    labels = list(panel.countries) + [pooled_label]
+    n_rows, n_years = r.shape
+    tidy = pd.DataFrame({
+        "Country": np.repeat(np.asarray(labels, dtype=object), n_years),
+        "Year": np.tile(panel.years, n_rows),
+        "rolling_r": r.ravel(),
+    })
+    return tidy.dropna(subset=["rolling_r"]).reset_index(drop=True)
@@ -0,0 +1,96 @@
+# coding: utf-8
+
+# # Country canonicalisation
+#
+# Step 5 used `df.replace("United States of America", "USA", regex=True)`, which regex-scans
+# every cell of every column (numbers included) and copies the whole frame.
+# WHO and World Bank extracts spell the same country many ways (ISO3 codes, long and short
+# names, historical names), so the names are mapped through an alias table instead.
+# The mapping runs over the categories of the categorical `Country` column, which costs
+# O(unique countries); the numeric columns are never touched.
+
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Alias table shipped next to this file: one `alias,canonical` pair per line
+ALIAS_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "country_aliases.csv")
+
+
+def alias_key(name):
+    """Lookup key for a country name: case and surrounding whitespace don't matter."""
+    return str(name).strip().casefold()
+
+
+@functools.lru_cache(maxsize=None)
+def load_aliases(path=ALIAS_TABLE):
+    """Read an alias table into a {alias key: canonical name} dict."""
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return {alias_key(alias): canonical for alias, canonical in zip(table["alias"], table["canonical"])}
+
+
+@functools.lru_cache(maxsize=None)
+def load_spellings(path=ALIAS_TABLE):
+    """Read an alias table into a {canonical key: set of spellings} dict (the inverse of `load_aliases`)."""
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    spellings = {}
+    for alias, canonical in zip(table["alias"], table["canonical"]):
+        spellings.setdefault(alias_key(canonical), {canonical}).add(alias)
+    return spellings
+
+
+def spellings(countries, path=ALIAS_TABLE):
+    """Every spelling of `countries` in the alias table, for filtering data not yet canonicalised.
+
+    `countries` may be canonical names or aliases. Sorted list.
+    """
+    aliases, known = load_aliases(path), load_spellings(path)
+    names = set()
+    for country in countries:
+        canonical = aliases.get(alias_key(country), country)
+        names.add(canonical)
+        names.update(known.get(alias_key(canonical), ()))
+    return sorted(names)
+
+
+def spelling_keys(countries, path=ALIAS_TABLE):
+    """`spellings` of `countries` trimmed and lower-cased, for filters on `lower(trim(Country))`.
+
+    Engines lower-case rather than casefold, so this is how `alias_key` compares the names
+    on their side.
+    """
+    return sorted({name.strip().lower() for name in spellings(countries, path)})
+
+
+def canonicalise_countries(df, aliases=None, column="Country"):
+    """Replace every country alias in `df[column]` with its canonical name, in place.
+
+    `aliases` is a {alias: canonical} dict; it defaults to country_aliases.csv.
+    Names that aren't in the table are kept as they are. Returns `df`.
+    """
+    if aliases is None:
+        aliases = load_aliases()
+    else:
+        aliases = {alias_key(alias): canonical for alias, canonical in aliases.items()}
+
+    countries = df[column]
+    if not isinstance(countries.dtype, pd.CategoricalDtype):
+        countries = countries.astype("category")
+    categories = countries.cat.categories
+
+    # Map each category once
+    mapped = [aliases.get(alias_key(name), name) for name in categories]
+    if len(set(mapped)) == len(mapped):
+        # One-to-one: rename the categories, the codes don't change
+        df[column] = countries.cat.rename_categories(mapped)
+        return df
+
+    # Several aliases of one country: merge their categories by re-pointing the codes
+    canonical, inverse = np.unique(np.asarray(mapped, dtype=object), return_inverse=True)
+    codes = countries.cat.codes.to_numpy()
+    codes = np.where(codes < 0, -1, inverse[codes])
+    df[column] = pd.Categorical.from_codes(codes, categories=canonical)
+    return df
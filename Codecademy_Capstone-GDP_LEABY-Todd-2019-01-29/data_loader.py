@@ -0,0 +1,112 @@
+# coding: utf-8
+
+# # Typed loader for all_data.csv
+#
+# `pd.read_csv("all_data.csv")` infers every dtype from the text on each run, which is what
+# dominates startup once the file covers every country and decades of years.
+# This loader reads only the columns we use, with an explicit schema, and keeps a
+# content-hashed Feather copy next to the CSV. Later runs memory-map that copy instead
+# of parsing the text again.
+
+import hashlib
+import os
+import re
+
+import pandas as pd
+
+
+# Column names as they appear in the CSV
+LEABY_COLUMN = "Life expectancy at birth (years)"
+
+# Explicit schema: categorical countries, narrow years, single precision measures
+SCHEMA = {
+    "Country": "category",
+    "Year": "int16",
+    LEABY_COLUMN: "float32",
+    "GDP": "float32",
+}
+
+CACHE_SUFFIX = ".feather"
+
+
+def file_digest(path, block_size=1 << 20):
+    """Hash the raw bytes of `path` (used as the cache key)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(path, columns):
+    """Cache file next to `path`: `<stem>.<contents hash>-<columns hash>.feather`."""
+    digest = hashlib.blake2b(digest_size=8)
+    for column in columns:
+        digest.update(("%s:%s;" % (column, SCHEMA[column])).encode())
+    stem = os.path.splitext(path)[0]
+    return "%s.%s-%s%s" % (stem, file_digest(path), digest.hexdigest(), CACHE_SUFFIX)
+
+
+def cache_pattern(path):
+    """Regex matching the names of `path`'s cache files; group 1 is the contents hash."""
+    stem = os.path.basename(os.path.splitext(path)[0])
+    return re.compile(r"%s\.([0-9a-f]{32})-[0-9a-f]{16}%s\Z" % (re.escape(stem), re.escape(CACHE_SUFFIX)))
+
+
+def read_typed_csv(path, columns=None, **kwargs):
+    """Parse `path` with the explicit schema, reading only `columns`."""
+    columns = list(SCHEMA) if columns is None else list(columns)
+    return pd.read_csv(
+        path,
+        usecols=columns,
+        dtype={column: SCHEMA[column] for column in columns},
+        **kwargs
+    )
+
+
+def load_all_data(path="all_data.csv", columns=None, cache=True):
+    """Load the GDP/life expectancy CSV with the explicit schema.
+
+    With `cache` on (and pyarrow installed), the first run writes a Feather copy
+    named after a hash of the CSV contents; later runs memory-map that copy.
+    Editing the CSV changes the hash, so a stale cache is never read.
+    """
+    columns = list(SCHEMA) if columns is None else list(columns)
+    unknown = [column for column in columns if column not in SCHEMA]
+    if unknown:
+        raise KeyError("Columns not in the all_data.csv schema: %s" % ", ".join(unknown))
+
+    if not cache:
+        return read_typed_csv(path, columns)
+    try:
+        from pyarrow import feather  # only the cache needs pyarrow, so it's imported here
+    except ImportError:  # No pyarrow: still load with the schema, just skip the cache
+        return read_typed_csv(path, columns)
+
+    cached = cache_path(path, columns)
+    if os.path.exists(cached):
+        table = feather.read_table(cached, memory_map=True)
+        return table.to_pandas(split_blocks=True)
+
+    df = read_typed_csv(path, columns)
+
+    # Drop caches of older versions of this CSV (any columns), then write atomically. The
+    # cache is only a speed-up: if the folder can't be written, the frame is returned as read.
+    pattern = cache_pattern(path)
+    contents = pattern.match(os.path.basename(cached)).group(1)
+    folder = os.path.dirname(os.path.abspath(path))
+    tmp = cached + ".tmp"
+    try:
+        for name in os.listdir(folder):
+            match = pattern.match(name)
+            if match and match.group(1) != contents:
+                os.remove(os.path.join(folder, name))
+        feather.write_feather(df, tmp, compression="uncompressed")
+        os.replace(tmp, cached)
+    except OSError:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    return df
@@ -0,0 +1,56 @@
+# coding: utf-8
+
+# # Level-of-detail downsampling for line plots
+#
+# With monthly or quarterly series for every country, the line plots would hand millions of
+# vertices to matplotlib, far more than the figure has pixel columns. Min/max bucketing (M4)
+# splits each line's x range into one bucket per pixel column and keeps, per bucket, the
+# first, last, lowest and highest point. A line rasterised from those points covers the same
+# pixels as the full line, so the saved PNG looks the same.
+#
+# All lines are bucketed at once: rows are sorted by (line, x), every row gets an integer
+# (line, bucket) key, and the four points per bucket come from `reduceat` over the key runs.
+
+import numpy as np
+
+
+def m4_indices(lines, x, y, buckets):
+    """Sorted row positions to keep so each line has at most 4 points per x bucket.
+
+    `lines` is an integer line id per row (e.g. country codes), `x`/`y` the coordinates and
+    `buckets` the number of buckets per line (usually the plot width in pixels).
+    """
+    lines = np.asarray(lines)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n == 0:
+        return np.arange(0)
+
+    order = np.lexsort((x, lines))
+    lines, x, y = lines[order], x[order], y[order]
+
+    # x range of each line, broadcast back to its rows
+    line_starts = np.concatenate(([0], np.flatnonzero(np.diff(lines)) + 1))
+    line_of_row = np.repeat(np.arange(len(line_starts)), np.diff(np.append(line_starts, n)))
+    x_min = x[line_starts][line_of_row]
+    x_max = x[np.append(line_starts[1:], n) - 1][line_of_row]
+    span = np.where(x_max > x_min, x_max - x_min, 1.0)
+
+    # Bucket per row, and runs of equal (line, bucket) keys
+    bucket = np.clip(((x - x_min) / span * buckets).astype(np.int64), 0, buckets - 1)
+    key = line_of_row.astype(np.int64) * buckets + bucket
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(key)) + 1))
+    ends = np.append(starts[1:], n)
+    run_of_row = np.repeat(np.arange(len(starts)), ends - starts)
+
+    # First occurrence of the bucket's min and max (NaNs are never picked)
+    position = np.arange(n)
+    low = np.fmin.reduceat(y, starts)
+    high = np.fmax.reduceat(y, starts)
+    argmin = np.minimum.reduceat(np.where(y == low[run_of_row], position, n), starts)
+    argmax = np.minimum.reduceat(np.where(y == high[run_of_row], position, n), starts)
+
+    keep = np.unique(np.concatenate((starts, ends - 1, argmin, argmax)))
+    keep = keep[keep < n]
+    return np.sort(order[keep])
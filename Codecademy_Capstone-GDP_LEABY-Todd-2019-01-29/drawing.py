@@ -0,0 +1,158 @@
+# coding: utf-8
+
+# # Drawing figure specs
+#
+# Every figure applies its own style inside a context manager, so no figure depends on what
+# the previous one set, and the output is the same however the specs are scheduled. Figures
+# are drawn on Agg canvases outside pyplot's figure manager; batches reuse pre-styled figure
+# templates (see templates.py). This module and templates.py are the only ones of the render
+# path that import matplotlib and seaborn; render.py loads them on the first miss.
+
+import os
+
+import numpy as np
+from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from density import violin_densities
+from export import FigureWriter
+from facets import facet_figure
+from plots import bar_from_summary, grouped_bar_from_summary, line_from_summary, violin_from_densities
+from shared import attach
+from specs import spec_data, summary_key, variant_paths
+from summary import Summaries
+from templates import Templates, spec_style, style_rc
+
+
+def draw(spec, df, ax, summaries=None):
+    """Draw the data layer of `spec` onto `ax`.
+
+    Bar and line figures draw from the summary in `summaries` (a `summary.Summaries`),
+    computed from `df` if it isn't there yet.
+    """
+    if spec.kind == "violin":
+        violin_from_densities(ax, violin_densities(df, spec.x, spec.y), x=spec.x, y=spec.y)
+        return
+    key = summary_key(spec)
+    if key is None:
+        raise ValueError("Unknown figure kind: %r" % spec.kind)
+    summary = (summaries if summaries is not None else Summaries()).get(key, df)
+    if spec.kind == "bar":
+        bar_from_summary(ax, summary, spec.y, x=spec.x)
+    elif spec.kind == "grouped_bar":
+        grouped_bar_from_summary(ax, summary, spec.y, x=spec.x, hue=spec.hue)
+    else:
+        # Downsampled lines keep at most 4 points per pixel column of the figure
+        pixels = int(ax.figure.get_figwidth() * ax.figure.dpi) if spec.downsample else None
+        line_from_summary(ax, summary, spec.y, x=spec.x, hue=spec.hue, pixels=pixels)
+        if spec.zoom is not None and spec.ylim is None:
+            zoom_to(ax, summary[spec.y], spec.hue, spec.zoom)
+
+
+def zoom_to(ax, stats, hue, levels):
+    """Fit the y axis to the lines (and CI bands) of the `hue` levels in `levels`."""
+    stats = stats[stats.index.get_level_values(hue).isin(levels)]
+    values = stats[["mean", "ci_low", "ci_high"]].to_numpy(dtype=float)
+    if np.isnan(values).all():
+        return
+    low, high = np.nanmin(values), np.nanmax(values)
+    pad = (high - low) * 0.05 or abs(high) * 0.05 or 0.5
+    ax.set_ylim(low - pad, high + pad)
+
+
+def style_scope(spec):
+    """Context manager applying the spec's style, context, rc overrides and palette."""
+    return plt.rc_context(style_rc(*spec_style(spec)))
+
+
+def render_figure(spec, df, templates=None, summaries=None):
+    """Build the figure for `spec` on an Agg canvas, outside pyplot's figure manager.
+
+    With a `templates.Templates`, the figure is a reused template: it is only valid until
+    the next figure is built from the same templates. `summaries` is passed on to `draw`.
+    """
+    with style_scope(spec):
+        if spec.facet is not None:
+            return facet_figure(spec_data(spec, df), spec.facet, spec.x, spec.y, hue=spec.hue,
+                                kind=spec.kind, col_wrap=spec.col_wrap, height=spec.height,
+                                color=spec.color, raster=spec.raster, panels_per_page=spec.panels_per_page,
+                                page=spec.page)
+        if templates is not None:
+            fig, ax = templates.figure(spec)
+        else:
+            fig = Figure(figsize=spec.figsize)
+            FigureCanvasAgg(fig)
+            ax = fig.subplots()
+        if summaries is not None and summary_key(spec) in summaries:
+            draw(spec, None, ax, summaries)  # already summarised: the rows aren't needed
+        else:
+            draw(spec, spec_data(spec, df), ax, summaries)
+        if spec.xlabel is not None:
+            ax.set_xlabel(spec.xlabel)
+        if spec.ylabel is not None:
+            ax.set_ylabel(spec.ylabel)
+        if spec.title is not None:
+            ax.set_title(spec.title)
+        if spec.legend:
+            ax.legend(**dict(spec.legend))
+        if spec.ylim is not None:
+            ax.set_ylim(*spec.ylim)
+    return fig
+
+
+def render_spec(spec, df, out_dir=".", formats=(), writer=None, templates=None, summaries=None):
+    """Render one spec to `out_dir` and return the file path.
+
+    `formats` adds copies in other formats next to it (e.g. ("svg", "pdf")). With an
+    `export.FigureWriter`, encoding and writing happen on its threads. With `templates`,
+    the figure is drawn on a reused template (see templates.py). With a
+    `summary.Summaries`, bar and line summaries are shared with the other figures.
+    """
+    fig = render_figure(spec, df, templates, summaries)
+    path = os.path.join(out_dir, spec.filename)
+    with style_scope(spec):
+        if writer is not None:
+            writer.submit(fig, path, formats)
+        else:
+            for target in variant_paths(path, formats):
+                fig.savefig(target)
+    return path
+
+
+def render_batch(specs, df, out_dir=".", formats=(), writer_threads=2, queue_depth=4, exports=None,
+                 summaries=None):
+    """Render `specs` in order, overlapping each figure's drawing with the last one's export.
+
+    Figures of the same style and size are drawn on one reused template, and each bar or
+    line summary is computed once for the batch; those in `summaries` (a
+    `summary.Summaries`) are not computed at all. A list passed as `exports` gets the size
+    and save time of every file written (see export.py).
+    """
+    templates = Templates()
+    summaries = Summaries(tables=summaries.tables if summaries is not None else None)
+    with FigureWriter(writer_threads, queue_depth) as writer:
+        paths = [render_spec(spec, df, out_dir, formats, writer, templates, summaries) for spec in specs]
+    if exports is not None:
+        exports.extend(writer.exports)
+    return paths
+
+
+# Worker state: the shared-memory frame, attached once per worker process (see shared.py),
+# and the summaries given to render_specs
+_worker_shared = None
+_worker_frame = None
+_worker_summaries = None
+
+
+def _init_worker(handle, summaries=None):
+    global _worker_shared, _worker_frame, _worker_summaries
+    _worker_shared = attach(handle)
+    _worker_frame = _worker_shared.data
+    _worker_summaries = summaries
+
+
+def _render_batch_in_worker(specs, out_dir, formats, writer_threads, queue_depth):
+    exports = []
+    render_batch(specs, _worker_frame, out_dir, formats, writer_threads, queue_depth, exports, _worker_summaries)
+    return exports
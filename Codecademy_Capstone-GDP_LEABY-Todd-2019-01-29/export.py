@@ -0,0 +1,106 @@
+# coding: utf-8
+
+# # Background figure export
+#
+# `fig.savefig(path)` draws the figure, compresses the PNG and writes it before the next
+# figure can even be started. `FigureWriter` keeps only the drawing on the caller's thread:
+# each finished canvas is copied into memory (raw RGBA for PNG, the serialised file for
+# SVG/PDF) and handed to a small pool of writer threads, which do the PNG compression
+# (zlib releases the GIL) and write every file atomically. The next figure is built while
+# the last one is encoded and written. At most `depth` buffers are in flight, so memory
+# stays bounded: `submit` waits when the queue is full.
+#
+# Every file written is recorded in `exports` (format, bytes, seconds to draw or serialise
+# it and seconds to encode and write it), so export size and save time can be tracked.
+
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from matplotlib import image
+
+from specs import variant_paths
+
+
+def atomic_write(path, data):
+    """Write `data` to `path` through a temporary file, so readers never see half a file."""
+    tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(tmp, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp, path)
+
+
+def encode_png(rgba, dpi):
+    """PNG bytes for an RGBA canvas copy, as `savefig` would write them."""
+    buffer = io.BytesIO()
+    image.imsave(buffer, rgba, format="png", origin="upper", dpi=dpi)
+    return buffer.getvalue()
+
+
+class FigureWriter(object):
+    """Bounded pool of threads that encode and write finished figures.
+
+    Use as a context manager; leaving it waits for every write and raises the first error.
+    """
+
+    def __init__(self, threads=2, depth=4):
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix="figure-writer")
+        self.slots = threading.BoundedSemaphore(depth)
+        self.futures = []
+        self.exports = []  # one dict per file written: path, format, bytes, draw_s, write_s
+
+    def submit(self, fig, path, formats=()):
+        """Draw `fig` now and write it to `path` (plus `formats` variants) in the background.
+
+        Call it where `fig.savefig` was called (inside the figure's style), since drawing
+        and vector serialisation read the rc settings. Returns the paths to be written.
+        """
+        paths = variant_paths(path, formats)
+        payloads = []
+        for target in paths:
+            fmt = os.path.splitext(target)[1][1:].lower()
+            started = time.perf_counter()
+            if fmt == "png":
+                fig.canvas.draw()
+                data, dpi = np.array(fig.canvas.buffer_rgba()), fig.dpi
+            else:
+                buffer = io.BytesIO()
+                fig.savefig(buffer, format=fmt)
+                data, dpi = buffer.getvalue(), None
+            payloads.append((target, data, dpi, time.perf_counter() - started))
+
+        self.slots.acquire()
+        try:
+            future = self.pool.submit(self._write, payloads)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        return paths
+
+    def _write(self, payloads):
+        for target, data, dpi, draw_s in payloads:
+            started = time.perf_counter()
+            if dpi is not None:
+                data = encode_png(data, dpi)
+            atomic_write(target, data)
+            self.exports.append({"path": target, "format": os.path.splitext(target)[1][1:].lower(),
+                                 "bytes": len(data), "draw_s": draw_s, "write_s": time.perf_counter() - started})
+
+    def close(self):
+        """Wait for every pending write; re-raise the first failure."""
+        self.pool.shutdown(wait=True)
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
@@ -0,0 +1,220 @@
+# coding: utf-8
+
+# # Small multiples
+#
+# Steps 8-10 used `sns.FacetGrid(df2, col=..., hue="Country")` and mapped `plt.scatter` or
+# `plt.plot` onto it. FacetGrid filters the frame with a boolean mask per panel (and per hue
+# level within each panel) and adds one artist per hue level, which gets slow with
+# ~190 countries and 60 years. Here the data is partitioned once by sorting on the facet
+# codes, each panel is a slice of the sorted arrays, and each panel is drawn with a single
+# collection. Panels can be split over several pages so each figure stays a manageable size.
+#
+# A collection is still one vector element per marker in SVG/PDF, so dense scatter pages
+# export slowly and grow huge. `raster="points"` rasterises the data layer only (axes, text
+# and legend stay vectors). `raster="density"` also bins each scatter panel into a 2-D
+# histogram on a shared grid and draws it as one image: each cell gets the count-weighted
+# mean colour of its hue levels, more opaque where more points fall.
+
+import math
+
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+
+from compact import stored_measure
+from plots import ScaledFormatter, palette
+from specs import page_filename
+
+
+def level_codes(values):
+    """Integer code per row and the sorted levels, for a categorical or plain column."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.remove_unused_categories()
+        return values.cat.codes.to_numpy(), values.cat.categories
+    codes, levels = pd.factorize(values, sort=True)
+    return codes, levels
+
+
+class Partition(object):
+    """Rows sorted by panel; panel `i` is rows `bounds[i]:bounds[i + 1]` of each array."""
+
+    def __init__(self, df, facet, columns):
+        codes, self.levels = level_codes(df[facet])
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.levels))
+        self.bounds = np.concatenate(([0], np.cumsum(counts)))
+        order = order[np.count_nonzero(codes < 0):]  # rows with a missing facet sort first
+        self.arrays = {column: np.asarray(values)[order] for column, values in columns.items()}
+
+    def __len__(self):
+        return len(self.levels)
+
+    def panel(self, i):
+        """Views of every array for panel `i`."""
+        rows = slice(self.bounds[i], self.bounds[i + 1])
+        return {column: values[rows] for column, values in self.arrays.items()}
+
+
+def grid_shape(n_panels, col_wrap):
+    ncols = min(col_wrap, n_panels)
+    return int(math.ceil(n_panels / float(ncols))), ncols
+
+
+RASTER_MODES = [None, "points", "density"]
+
+
+def density_image(data, colors, extent, bins):
+    """RGBA image (rows from the bottom) of one panel's points binned on the `extent` grid."""
+    x0, x1, y0, y1 = extent
+    x, y = np.asarray(data["x"], dtype=np.float64), np.asarray(data["y"], dtype=np.float64)
+    keep = ~np.isnan(x) & ~np.isnan(y)
+    column = np.clip(((x[keep] - x0) / (x1 - x0) * bins).astype(np.intp), 0, bins - 1)
+    row = np.clip(((y[keep] - y0) / (y1 - y0) * bins).astype(np.intp), 0, bins - 1)
+    cell = row * bins + column
+    rgb = colors[data["hue"][keep], :3]
+    count = np.bincount(cell, minlength=bins * bins)
+    image = np.zeros((bins * bins, 4))
+    filled = count > 0
+    for channel in range(3):
+        sums = np.bincount(cell, weights=rgb[:, channel], minlength=bins * bins)
+        image[filled, channel] = sums[filled] / count[filled]
+    if filled.any():
+        # Log-scaled opacity, so single points stay visible next to crowded cells
+        image[filled, 3] = 0.5 + 0.5 * np.log1p(count[filled]) / np.log1p(count.max())
+    return image.reshape(bins, bins, 4)
+
+
+def draw_panel(ax, data, kind, colors, edgecolor, raster=None, extent=None, bins=256):
+    """Draw one panel's points with a single collection (or image, see RASTER_MODES)."""
+    if kind == "scatter":
+        if raster == "density":
+            ax.imshow(density_image(data, colors, extent, bins), extent=extent, origin="lower",
+                      aspect="auto", interpolation="nearest")
+            return
+        ax.scatter(data["x"], data["y"], c=colors[data["hue"]], edgecolor=edgecolor,
+                   rasterized=raster is not None)
+        return
+    # Lines: one segment list per hue level, all in one LineCollection
+    order = np.lexsort((data["x"], data["hue"]))
+    xs, ys, hues = data["x"][order], data["y"][order], data["hue"][order]
+    splits = np.flatnonzero(np.diff(hues)) + 1
+    segments = [np.column_stack(part) for part in zip(np.split(xs, splits), np.split(ys, splits))]
+    starts = np.concatenate(([0], splits)).astype(int)
+    lines = LineCollection(segments, colors=colors[hues[starts]],
+                           linewidths=plt.rcParams["lines.linewidth"], rasterized=raster is not None)
+    ax.add_collection(lines)
+    ax.autoscale_view()
+
+
+def data_extent(x, y):
+    """(x0, x1, y0, y1) around the non-NaN points, padded by 5% (matplotlib's default margins)."""
+    extent = []
+    for values in (x, y):
+        low, high = np.nanmin(values), np.nanmax(values)
+        pad = (high - low) * 0.05 or 0.5
+        extent += [low - pad, high + pad]
+    return tuple(extent)
+
+
+def facet_pages(df, facet, x, y, hue=None, kind="scatter", col_wrap=4, height=2, aspect=1,
+                panels_per_page=None, color=None, edgecolor="w", legend=True, raster=None, bins=None,
+                page=None):
+    """Yield one Figure per page of small multiples, one panel per level of `facet`.
+
+    Pages hold `panels_per_page` panels (default: all); with `page` (counting from 1), only
+    that page is drawn.
+
+    `kind` is "scatter" (like mapping plt.scatter) or "line" (like plt.plot). Points are
+    coloured by `hue` if given, otherwise with `color` or the first palette colour.
+    `raster` is one of RASTER_MODES; "density" bins scatter panels on a `bins` x `bins` grid
+    (default: cells half a marker wide, so a lone point stays as visible as its marker).
+    Figures are on Agg canvases; save them with `fig.savefig`.
+    """
+    if raster not in RASTER_MODES:
+        raise ValueError("Unknown raster mode %r (choose from %s)" % (raster, RASTER_MODES))
+    # A scaled measure missing from `df` (compact frames) is drawn from its stored column
+    # and only relabelled at the ticks
+    x_column, x_scale = stored_measure(df, x)
+    y_column, y_scale = stored_measure(df, y)
+    columns = {"x": df[x_column], "y": df[y_column]}
+    if hue is not None:
+        hue_codes, hue_levels = level_codes(df[hue])
+        colors = to_rgba_array(palette(len(hue_levels)))
+    else:
+        hue_codes, hue_levels = np.zeros(len(df), dtype=int), []
+        colors = to_rgba_array([color or palette(1)[0]])
+    columns["hue"] = hue_codes
+    partition = Partition(df, facet, columns)
+    extent = None
+    if raster == "density" and kind == "scatter":
+        # One grid for every panel, as the axes are shared
+        extent = data_extent(partition.arrays["x"].astype(np.float64), partition.arrays["y"].astype(np.float64))
+        if bins is None:
+            marker_inches = plt.rcParams["lines.markersize"] / 72  # scatter markers are this wide
+            bins = max(1, int(round(2 * height / marker_inches)))
+
+    show_legend = legend and len(hue_levels) > 0
+
+    n_panels = len(partition)
+    per_page = panels_per_page or n_panels
+    firsts = range(0, n_panels, per_page)
+    if page is not None:
+        firsts = firsts[page - 1:page]
+    for first in firsts:
+        panels = range(first, min(first + per_page, n_panels))
+        nrows, ncols = grid_shape(len(panels), col_wrap)
+        panels_width = ncols * height * aspect
+        fig = Figure(figsize=(panels_width, nrows * height))
+        FigureCanvasAgg(fig)
+        axes = fig.subplots(nrows, ncols, sharex=True, sharey=True, squeeze=False).ravel()
+        for ax, i in zip(axes, panels):
+            draw_panel(ax, partition.panel(i), kind, colors, edgecolor, raster, extent, bins)
+            ax.set_title("%s = %s" % (facet, partition.levels[i]))
+            if x_scale != 1:
+                ax.xaxis.set_major_formatter(ScaledFormatter(x_scale))
+            if y_scale != 1:
+                ax.yaxis.set_major_formatter(ScaledFormatter(y_scale))
+        for ax in axes[len(panels):]:
+            ax.set_visible(False)
+        for ax in axes[(nrows - 1) * ncols:]:
+            ax.set_xlabel(x)
+        for ax in axes[::ncols]:
+            ax.set_ylabel(y)
+        right = 1
+        if show_legend:
+            # Widen the page by the legend's width and put it there (like FacetGrid.add_legend)
+            handles = [Line2D([], [], color=colors[i], marker="o" if kind == "scatter" else None,
+                              linestyle="" if kind == "scatter" else "-")
+                       for i in range(len(hue_levels))]
+            key = fig.legend(handles, list(hue_levels), title=hue, loc="center right", frameon=False)
+            legend_width = key.get_window_extent(fig.canvas.get_renderer()).width / fig.dpi
+            fig.set_size_inches(panels_width + legend_width, nrows * height)
+            right = panels_width / (panels_width + legend_width)
+        fig.tight_layout(rect=(0, 0, right, 1))
+        yield fig
+
+
+def facet_figure(df, facet, x, y, panels_per_page=None, page=None, **kwargs):
+    """One figure of small multiples: all panels (what `sns.FacetGrid(...).map(...)` produced),
+    or page `page` of pages holding `panels_per_page` panels.
+    """
+    if panels_per_page is None or page is None:
+        panels_per_page, page = None, None
+    return next(facet_pages(df, facet, x, y, panels_per_page=panels_per_page, page=page, **kwargs))
+
+
+def save_facet_pages(df, path, facet, x, y, **kwargs):
+    """Save every page as `<stem>_p<n><ext>` and return the paths.
+
+    Pages are saved and dropped one at a time, so memory holds one page at a time.
+    """
+    paths = []
+    for page, fig in enumerate(facet_pages(df, facet, x, y, **kwargs), 1):
+        paths.append(page_filename(path, page))
+        fig.savefig(paths[-1])
+    return paths
@@ -0,0 +1,134 @@
+# coding: utf-8
+
+# # Content-addressed figure cache
+#
+# Every run used to overwrite every PNG, even when neither the data nor the plot code had
+# changed. The cache keys each figure on a hash of
+#   - the slice of data the figure draws (hashed straight from the column buffers),
+#   - the figure spec, which includes its palette/style/context/rc settings,
+#   - the plotting code and the library versions.
+# Rendered files are stored under their key; on a hit the output is copied back from the
+# store without touching matplotlib, so a no-op rebuild costs milliseconds.
+#
+# Outputs and store entries are always separate files (copies, never hard links): the
+# figures are small, and every write path (`savefig`, `export.atomic_write`) can then write
+# its output however it likes without changing what a later cache hit serves.
+
+import dataclasses
+import functools
+import hashlib
+import os
+import shutil
+from importlib import metadata
+
+import numpy as np
+import pandas as pd
+
+from compact import stored_measure
+from specs import spec_data, summary_key
+
+
+# Libraries whose version changes what a figure looks like
+LIBRARIES = ["matplotlib", "seaborn", "pandas", "numpy"]
+
+# Modules that draw the figures: editing one invalidates the cache
+PLOT_CODE = ["compact.py", "density.py", "downsample.py", "drawing.py", "export.py", "facets.py", "panel.py",
+             "plots.py", "render.py", "specs.py", "summary.py", "templates.py"]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+@functools.lru_cache(maxsize=None)
+def environment_digest():
+    """Hash of the library versions and the plotting code."""
+    digest = hashlib.blake2b(digest_size=16)
+    for library in LIBRARIES:
+        try:
+            version = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            version = "missing"
+        digest.update(("%s=%s;" % (library, version)).encode())
+    for name in PLOT_CODE:
+        path = os.path.join(HERE, name)
+        if os.path.exists(path):
+            with open(path, "rb") as handle:
+                digest.update(handle.read())
+    return digest.hexdigest()
+
+
+def update_with_column(digest, values):
+    """Feed one column to `digest` from its memory buffer (no pickling, no per-row work)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        update_with_column(digest, values.cat.categories.to_series())
+        values = values.cat.codes
+    array = values.to_numpy()
+    if array.dtype == object:
+        # Strings: hash them vectorised, then hash the fixed-width result
+        array = pd.util.hash_array(array)
+    digest.update(str(array.dtype).encode())
+    digest.update(np.ascontiguousarray(array).view(np.uint8))
+
+
+def data_digest(df, columns):
+    """Hash of `columns` of `df`, in row order (scaled measures hash their stored column)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(len(df)).encode())
+    for column in columns:
+        stored, _ = stored_measure(df, column)
+        digest.update(stored.encode())
+        update_with_column(digest, df[stored])
+    return digest.hexdigest()
+
+
+def spec_columns(spec):
+    """Data columns a spec reads."""
+    columns = [spec.x, spec.y, spec.hue, spec.facet, "Country"]
+    return sorted(set(column for column in columns if column is not None))
+
+
+def figure_key(spec, df, summaries=None):
+    """Cache key for rendering `spec` from `df`, or from its summary in `summaries` if it's there."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(environment_digest().encode())
+    digest.update(repr(dataclasses.astuple(spec)).encode())
+    key = summary_key(spec)
+    if summaries is not None and key in summaries:
+        digest.update(b"summary")
+        digest.update(pd.util.hash_pandas_object(summaries.tables[key]).to_numpy().view(np.uint8))
+    else:
+        digest.update(data_digest(spec_data(spec, df), spec_columns(spec)).encode())
+    return digest.hexdigest()
+
+
+class FigureCache(object):
+    """Store of rendered figure files, addressed by `figure_key`."""
+
+    def __init__(self, cache_dir=".figure_cache"):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def stored_path(self, key, filename):
+        return os.path.join(self.cache_dir, key + os.path.splitext(filename)[1])
+
+    def fetch(self, key, path):
+        """Put a copy of the stored figure for `key` at `path`. Returns False on a miss."""
+        stored = self.stored_path(key, path)
+        # The old output may be a hard link into the store (as older versions made them):
+        # remove it so neither copying nor re-rendering can write through to a stored figure
+        if os.path.exists(path):
+            os.remove(path)
+        if not os.path.exists(stored):
+            return False
+        copy_replace(stored, path)
+        return True
+
+    def store(self, key, path):
+        """Keep the freshly rendered file at `path` under `key`."""
+        copy_replace(path, self.stored_path(key, path))
+
+
+def copy_replace(source, destination):
+    """Copy `source` to `destination` through a temporary file, replacing it whole."""
+    tmp = "%s.%d.tmp" % (destination, os.getpid())
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, destination)
@@ -0,0 +1,88 @@
+# coding: utf-8
+
+# # Incremental updates
+#
+# WHO and the World Bank publish one new year at a time, but every release used to re-read
+# all the data, recompute every per-Country mean and CI and redraw every figure. An
+# `IncrementalStore` keeps, between runs,
+#   - running aggregates (count, sum, sum of squares, min, max) per Country and per
+#     (Country, Year), as in streaming.py,
+#   - the (Country x Year) panel (panel.py),
+# and `update` folds in just the new (Country, Year) rows. It returns which countries and
+# country-years changed, and `stale` picks the figures that draw any of them.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from panel import Panel
+from streaming import GROUPINGS, MEASURES, RunningAggregates
+
+
+class IncrementalStore(object):
+    """Persisted aggregates and panel in `state_dir`."""
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.panel = None
+        self.aggregates = {keys: RunningAggregates(keys, MEASURES) for keys in GROUPINGS}
+        if os.path.exists(self.panel_path):
+            self.panel = Panel.load(self.panel_path)
+            self.aggregates = {keys: RunningAggregates.load(self.aggregates_path(keys), keys, MEASURES)
+                               for keys in GROUPINGS}
+
+    @property
+    def panel_path(self):
+        return os.path.join(self.state_dir, "panel.npz")
+
+    def aggregates_path(self, keys):
+        return os.path.join(self.state_dir, "aggregates_%s.csv" % "_".join(keys))
+
+    def summary(self, keys=("Country",)):
+        """Mean/std/CI/min/max per group, from the running aggregates."""
+        return self.aggregates[tuple(keys)].summary()
+
+    def update(self, rows):
+        """Fold new normalised rows (Country, Year, LEABY, GDP, GDPinTrillions) into the store.
+
+        Only country-years that aren't in the store yet are accepted: folding a revised row in
+        twice would double count it, so that raises ValueError. Returns the set of changed
+        countries and the set of changed (Country, Year) pairs.
+        """
+        countries = rows["Country"].astype(object).to_numpy()
+        years = rows["Year"].to_numpy()
+        pairs = pd.MultiIndex.from_arrays([countries, years])
+        if pairs.has_duplicates:
+            raise ValueError("The update has duplicate Country/Year rows")
+        if self.panel is not None:
+            known = self.panel.countries.get_indexer(countries)
+            column = years - self.panel.first_year
+            inside = (known >= 0) & (column >= 0) & (column < self.panel.shape[1])
+            filled = np.zeros(len(rows), dtype=bool)
+            for array in self.panel.arrays.values():
+                filled[inside] |= ~np.isnan(array[known[inside], column[inside]])
+            if filled.any():
+                raise ValueError("Already in the store: %s" % ", ".join(
+                    "%s %d" % pair for pair in pairs[filled][:5]))
+
+        for aggregate in self.aggregates.values():
+            aggregate.update(rows)
+        if self.panel is None:
+            self.panel = Panel.from_long(rows)
+        else:
+            self.panel = self.panel.updated(rows)
+        self.save()
+        return set(countries), set(pairs)
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        for keys, aggregate in self.aggregates.items():
+            aggregate.save(self.aggregates_path(keys))
+        self.panel.save(self.panel_path)
+
+
+def stale(specs, changed_countries):
+    """The specs that draw any of `changed_countries` (specs without a subset draw them all)."""
+    changed = set(changed_countries)
+    return [spec for spec in specs if spec.countries is None or changed.intersection(spec.countries)]
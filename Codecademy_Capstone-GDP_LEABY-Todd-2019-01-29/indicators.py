@@ -0,0 +1,200 @@
+# coding: utf-8
+
+# # Indicator registry and join
+#
+# all_data.csv is one pre-joined file with two measures. Other WHO and World Bank indicators
+# (health spending, population, mortality ...) come one file each, keyed on Country/Year.
+# Joining them with chained `pd.merge` calls builds a new long frame and hash table for
+# every indicator added. Instead, each indicator is registered once (file, value column,
+# label) and written straight into a shared integer key space:
+#   key = country code * number of years + (year - first year),
+# which is the row-by-row layout of a `panel.Panel` array. Adding an indicator is one
+# scatter of its rows into its (NaN-filled) panel array; the key and duplicate checks
+# cost O(rows of that indicator), with no hash join. The joined long frame is
+# `Panel.to_long`, one gather of the present cells, already sorted by Country, then Year.
+
+import dataclasses
+import os
+
+import numpy as np
+import pandas as pd
+
+from countries import canonicalise_countries
+from data_loader import LEABY_COLUMN
+from panel import Panel
+
+
+@dataclasses.dataclass(frozen=True)
+class Indicator(object):
+    """Where one indicator's values are and how to label them."""
+
+    name: str
+    path: str  # CSV with one row per country-year
+    column: str
+    label: str = None
+    country: str = "Country"
+    year: str = "Year"
+    scale: float = 1  # values are divided by this, e.g. 1e12 for GDP in trillions
+
+
+# The measures of all_data.csv, already in df2; other indicators are added with `register`
+# or a registry table (see `load_registry`)
+INDICATORS = {
+    "GDP": Indicator("GDP", "all_data.csv", "GDP", "GDP in U.S. Dollars"),
+    "GDPinTrillions": Indicator("GDPinTrillions", "all_data.csv", "GDP", "GDP in Trillions of U.S. Dollars",
+                                scale=1e12),
+    "LEABY": Indicator("LEABY", "all_data.csv", LEABY_COLUMN, "Life Expectancy at Birth in Years"),
+}
+
+
+def register(indicator, registry=None):
+    """Add `indicator` to `registry` (default: INDICATORS) and return it."""
+    registry = INDICATORS if registry is None else registry
+    registry[indicator.name] = indicator
+    return indicator
+
+
+def load_registry(path):
+    """Read a registry table: one row per indicator, with the `Indicator` fields as columns.
+
+    `name`, `path` and `column` are required; empty cells take the defaults. Relative
+    paths are read from the table's folder.
+    """
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    folder = os.path.dirname(os.path.abspath(path))
+    registry = {}
+    for row in table.to_dict("records"):
+        fields = {field: value for field, value in row.items() if value != ""}
+        fields["path"] = os.path.join(folder, fields["path"])
+        if "scale" in fields:
+            fields["scale"] = float(fields["scale"])
+        register(Indicator(**fields), registry)
+    return registry
+
+
+def label(name, registry=None):
+    """Axis label of a registered indicator (its name if it has none)."""
+    registry = INDICATORS if registry is None else registry
+    indicator = registry.get(name)
+    return indicator.label if indicator is not None and indicator.label else name
+
+
+def read_indicators(indicators, data_dir="."):
+    """{name: frame of Country (categorical, canonical names), Year, value} per indicator.
+
+    Indicators stored in the same file are read in one pass. Rows with no value are left out.
+    """
+    by_file = {}
+    for indicator in indicators:
+        by_file.setdefault((indicator.path, indicator.country, indicator.year), []).append(indicator)
+
+    tables = {}
+    for (path, country, year), group in by_file.items():
+        columns = [country, year] + sorted(set(indicator.column for indicator in group))
+        raw = pd.read_csv(os.path.join(data_dir, path), usecols=columns, dtype={country: "category"})
+        countries = canonicalise_countries(pd.DataFrame({"Country": raw[country]}))["Country"]
+        years = raw[year].to_numpy(dtype=np.float64)
+        for indicator in group:
+            values = raw[indicator.column].to_numpy(dtype=np.float64)
+            if indicator.scale != 1:
+                values = values / indicator.scale
+            keep = ~np.isnan(values) & ~np.isnan(years) & (countries.cat.codes.to_numpy() >= 0)
+            tables[indicator.name] = pd.DataFrame({
+                "Country": countries[keep].reset_index(drop=True),
+                "Year": years[keep].astype(np.int64),
+                "value": values[keep],
+            })
+    return tables
+
+
+class KeySpace(object):
+    """(country, year) pairs as integers: country code * n_years + (year - first_year).
+
+    Country codes follow the sorted country index, so keys sort by Country, then Year.
+    """
+
+    def __init__(self, countries, first_year, last_year):
+        self.countries = pd.Index(countries, name="Country")
+        self.first_year = int(first_year)
+        self.n_years = int(last_year) - self.first_year + 1
+
+    @classmethod
+    def covering(cls, tables, panel=None):
+        """Smallest key space holding every row of `tables` and every cell of `panel`."""
+        countries = pd.Index([], dtype=object)
+        first_years, last_years = [], []
+        if panel is not None:
+            countries = pd.Index(panel.countries, dtype=object)
+            first_years.append(panel.first_year)
+            last_years.append(panel.first_year + panel.shape[1] - 1)
+        for table in tables:
+            # The categories, not the rows: O(distinct countries)
+            countries = countries.union(pd.Index(table["Country"].cat.categories, dtype=object), sort=False)
+            if len(table):
+                first_years.append(int(table["Year"].min()))
+                last_years.append(int(table["Year"].max()))
+        if not first_years:
+            raise ValueError("Nothing to join: no indicator has any rows")
+        return cls(countries.sort_values(), min(first_years), max(last_years))
+
+    @property
+    def shape(self):
+        return len(self.countries), self.n_years
+
+    @property
+    def size(self):
+        return len(self.countries) * self.n_years
+
+    def keys(self, countries, years):
+        """Key of each row; `countries` is categorical, so names are looked up once each."""
+        lookup = self.countries.get_indexer(countries.cat.categories)
+        return lookup[countries.cat.codes.to_numpy()] * self.n_years + (np.asarray(years) - self.first_year)
+
+    def scatter(self, keys, values, name="indicator"):
+        """(country x year) array with `values` at `keys` and NaN elsewhere."""
+        ordered = np.sort(keys)
+        if (ordered[1:] == ordered[:-1]).any():
+            raise ValueError("%s has more than one row for a Country/Year" % name)
+        array = np.full(self.size, np.nan)
+        array[keys] = values
+        return array.reshape(self.shape)
+
+    def relayout(self, panel):
+        """The arrays of `panel` in this key space (the same arrays if the space is the panel's)."""
+        if self.countries.equals(panel.countries) and (self.first_year, self.n_years) == (
+                panel.first_year, panel.shape[1]):
+            return dict(panel.arrays)
+        rows = self.countries.get_indexer(panel.countries)
+        columns = slice(panel.first_year - self.first_year, panel.first_year - self.first_year + panel.shape[1])
+        arrays = {}
+        for measure, old in panel.arrays.items():
+            array = np.full(self.shape, np.nan)
+            array[rows, columns] = old
+            arrays[measure] = array
+        return arrays
+
+
+def join_tables(tables, panel=None):
+    """Panel of the `read_indicators` tables, plus the measures of `panel` if given."""
+    space = KeySpace.covering(tables.values(), panel)
+    arrays = space.relayout(panel) if panel is not None else {}
+    for name, table in tables.items():
+        keys = space.keys(table["Country"], table["Year"].to_numpy())
+        arrays[name] = space.scatter(keys, table["value"].to_numpy(), name)
+    return Panel(space.countries, space.first_year, arrays)
+
+
+def join(names, data_dir=".", registry=None, panel=None):
+    """Panel of the registered indicators `names`, added to `panel` if given.
+
+    Indicators already in `panel` are not read again. Raises KeyError for a name that isn't
+    registered and ValueError for an indicator with duplicate Country/Year rows.
+    """
+    registry = INDICATORS if registry is None else registry
+    names = [name for name in dict.fromkeys(names) if panel is None or name not in panel]
+    unknown = [name for name in names if name not in registry]
+    if unknown:
+        raise KeyError("Unknown indicators: %s" % ", ".join(unknown))
+    if not names:
+        return panel
+    return join_tables(read_indicators([registry[name] for name in names], data_dir), panel)
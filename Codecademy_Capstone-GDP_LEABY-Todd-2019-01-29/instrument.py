@@ -0,0 +1,97 @@
+# coding: utf-8
+
+# # Stage instrumentation
+#
+# Wall time, peak resident memory and throughput for each pipeline stage, collected into a
+# JSON report so runs can be compared and regressions spotted.
+
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, memory is reported as null
+    resource = None
+
+
+def peak_rss_mb():
+    """Peak resident set size so far (this process and finished children), in MB."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1.0 / (1024 * 1024) if sys.platform == "darwin" else 1.0 / 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return round(max(own, children), 1)
+
+
+def export_totals(exports):
+    """Files, bytes and seconds to save (draw or serialise, then write) per format.
+
+    `exports` are the per-file records of `export.FigureWriter`.
+    """
+    totals = {}
+    for record in exports:
+        total = totals.setdefault(record["format"], {"files": 0, "bytes": 0, "save_s": 0.0, "largest_bytes": 0})
+        total["files"] += 1
+        total["bytes"] += record["bytes"]
+        total["save_s"] = round(total["save_s"] + record["draw_s"] + record["write_s"], 6)
+        total["largest_bytes"] = max(total["largest_bytes"], record["bytes"])
+    return totals
+
+
+class Stage(object):
+    """Times one stage. Set `rows` inside the `with` block to get rows/sec."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.extra = {}
+
+    def __enter__(self):
+        self.rss_before = peak_rss_mb()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_s = time.perf_counter() - self.started
+        self.rss_after = peak_rss_mb()
+        return False
+
+    def as_dict(self):
+        record = {"stage": self.name, "wall_s": round(self.wall_s, 6), "peak_rss_mb": self.rss_after}
+        if self.rss_before is not None:
+            # Growth of the high-water mark during this stage
+            record["peak_rss_growth_mb"] = round(self.rss_after - self.rss_before, 1)
+        if self.rows is not None:
+            record["rows"] = int(self.rows)
+            record["rows_per_s"] = round(self.rows / self.wall_s, 1) if self.wall_s > 0 else None
+        record.update(self.extra)
+        return record
+
+
+class Report(object):
+    """Collects stage records; `stage(name)` returns a Stage to use as a context manager."""
+
+    def __init__(self, **info):
+        self.info = info
+        self.stages = []
+        self.started = time.perf_counter()
+
+    def stage(self, name):
+        stage = Stage(name)
+        self.stages.append(stage)
+        return stage
+
+    def as_dict(self):
+        report = dict(self.info)
+        report["stages"] = [stage.as_dict() for stage in self.stages]
+        report["total_wall_s"] = round(time.perf_counter() - self.started, 6)
+        report["peak_rss_mb"] = peak_rss_mb()
+        return report
+
+    def write(self, path):
+        with open(path, "w") as handle:
+            json.dump(self.as_dict(), handle, indent=2)
+            handle.write("\n")
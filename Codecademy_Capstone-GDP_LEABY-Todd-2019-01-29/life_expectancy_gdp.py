@@ -31,9 +31,36 @@
 # In[1]:
 
 
-from matplotlib import pyplot as plt
-import pandas as pd
-import seaborn as sns
+# This script now runs headless from the command line (see main() at the bottom): each
+# stage below is a function, the figures are declared as specs, and they are saved
+# instead of shown.
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+# Start-up cost of this script's own imports, reported with each run. matplotlib and seaborn
+# are not among them: they load only when a figure has to be drawn (see render.py)
+IMPORTS_STARTED = time.perf_counter()
+
+from changes import change_summary, largest_yearly_changes
+from compact import compact, memory_report
+from correlation import correlations, rolling_correlations
+from data_loader import load_all_data
+from figure_cache import FigureCache
+from incremental import IncrementalStore, stale
+from indicators import INDICATORS, join, label, load_registry
+from instrument import Report, export_totals
+from panel import Panel, as_panel
+from render import render_specs
+from specs import FigureSpec, for_indicator, paginated, rasterised
+from streaming import prepare_chunk, stream_aggregates, summary_panel
+from summary import Summaries, summarise
+
+IMPORT_S = time.perf_counter() - IMPORTS_STARTED
 
 
 # ## Step 2 Prep The Data
@@ -48,8 +75,13 @@ import seaborn as sns
 # In[2]:
 
 
-df = pd.read_csv("all_data.csv")
-print(df.head())
+# Typed loader: only the columns we use, explicit dtypes, and a Feather cache next to the CSV
+# that later runs memory-map instead of re-parsing the text (see data_loader.py)
+def load(path="all_data.csv"):
+    """Stage "load": read the CSV into `df`."""
+    df = load_all_data(path)
+    #print(df.head())
+    return df
 
 
 # ## Step 3 Examine The Data
@@ -83,7 +115,7 @@ print(df.head())
 # In[5]:
 
 
-print(df.head())
+#print(df.head())
 
 
 # What do you notice? The first two column names are one word each, and the third is five words long! `Life expectancy at birth (years)` is descriptive, which will be good for labeling the axis, but a little difficult to wrangle for coding the plot itself. 
@@ -100,10 +132,7 @@ print(df.head())
 # NOTE: The directions indicate that I should "change the name of the LAST column to LEABY", but the last column is GDP.
 # I'm going to assume that I should change the "Life expectancy at birth (years)" column to "LEABY" instead.
 
-# Rename column
-df.rename(columns={
-  'Life expectancy at birth (years)': 'LEABY'},
-  inplace=True)
+# Rename column: 'Life expectancy at birth (years)' becomes 'LEABY' in normalise() below
 
 
 # Run `df.head()` again to check your new column name worked.
@@ -111,7 +140,7 @@ df.rename(columns={
 # In[7]:
 
 
-print(df.head())
+#print(df.head())
 
 #Success!
 
@@ -129,40 +158,88 @@ print(df.head())
 
 
 # RENAME "United States of America" TO "USA"
-# To make graphing countries easier, replace "United States of America" with "USA", 
-# according to code/examples here: https://pandas.pydata.org/pandas-docs/stable/generated/pandas.DataFrame.replace.html
-
-df2 = df.replace(to_replace="United States of America", value="USA", regex=True)
-#print(df2.head(97)) - SUCCESS! df2 has "USA" instead of "United States of America" 
-
+# To make graphing countries easier, replace "United States of America" with "USA".
+# The alias table (country_aliases.csv) also covers ISO3 codes, long names and historical names.
+# It is applied to the Country categories, so the numeric columns are neither scanned nor copied
+# (see countries.py)
 
 # CALCULATE GDP DIVIDED BY A TRILLION
 # To make the GDP graph easier to read, create a calculated column "GDPinTrillions"
-df2['GDPinTrillions'] = df2["GDP"]/1000000000000
-
-
-# Define mtick
-import matplotlib.ticker as mtick
-
-# Set color palette
-sns.set_palette("Set1")
 
-# Set style
-sns.set_style("ticks")
-sns.set_context("talk")
+def normalise(df, compact_frame=False):
+    """Stage "normalise": the Step 4 rename plus the Step 5 USA rename and GDPinTrillions.
+
+    These are the same steps the streaming reader applies to each chunk (see streaming.py).
+    With `compact_frame`, `df2` gets the compact dtypes and GDPinTrillions is left to be
+    derived from GDP on read (see compact.py).
+    """
+    df2 = prepare_chunk(df.copy(deep=False), scaled=not compact_frame)
+    if compact_frame:
+        df2 = compact(df2)
+    #print(df2.head(97)) - SUCCESS! df2 has "USA" instead of "United States of America"
+    return df2
+
+
+# PANEL, SUMMARIES AND CORRELATIONS
+# GDP, GDPinTrillions and LEABY are pivoted once into (Country x Year) arrays, so selecting a
+# country, a year or a range of years is a view instead of a scan (see panel.py).
+# Means and bootstrapped CIs per Country and per Country/Year are computed in one grouped pass
+# (see summary.py); the bar and line plots draw from the same kind of summary (see plots.py).
+
+def aggregate(df2, out_dir=".", source=None, streamed=None):
+    """Stage "aggregate": panel, summaries and correlations; the tables are saved as CSV.
+
+    With a `query.ParquetSource` instead of `df2`, the panel and summaries are queried from
+    disk (their CIs use the normal approximation, as streamed summaries do). With the
+    `stream_aggregates` result as `streamed`, they are taken from it.
+    """
+    if streamed is not None:
+        panel = summary_panel(streamed[("Country", "Year")])
+        country_summary = streamed[("Country",)][["GDPinTrillions", "LEABY"]]
+        year_summary = streamed[("Country", "Year")][["GDPinTrillions", "LEABY"]]
+    elif source is not None:
+        panel = source.panel()
+        country_summary = source.summary(["Country"], ["GDPinTrillions", "LEABY"])
+        year_summary = source.summary(["Country", "Year"], ["GDPinTrillions", "LEABY"])
+    else:
+        panel = Panel.from_long(df2)
+        country_summary = summarise(df2, ["Country"], ["GDPinTrillions", "LEABY"])
+        year_summary = summarise(df2, ["Country", "Year"], ["GDPinTrillions", "LEABY"])
+    gdp_leaby_r = correlations(panel)
+    rolling_r = rolling_correlations(panel, window=5)
+    changes = change_summary(panel, ["GDP", "LEABY"])
+    yearly_changes = largest_yearly_changes(panel, ["GDP", "LEABY"], k=10)
+
+    country_summary.to_csv(os.path.join(out_dir, "summary_by_country.csv"))
+    year_summary.to_csv(os.path.join(out_dir, "summary_by_country_year.csv"))
+    gdp_leaby_r.to_csv(os.path.join(out_dir, "correlations.csv"), index=False)
+    rolling_r.to_csv(os.path.join(out_dir, "rolling_correlations.csv"), index=False)
+    changes.to_csv(os.path.join(out_dir, "changes.csv"), index=False)
+    yearly_changes.to_csv(os.path.join(out_dir, "largest_yearly_changes.csv"), index=False)
+    return {
+        "panel": panel,
+        "country_summary": country_summary,
+        "year_summary": year_summary,
+        "correlations": gdp_leaby_r,
+        "rolling_correlations": rolling_r,
+        "changes": changes,
+        "largest_yearly_changes": yearly_changes,
+    }
+
+
+# The exploratory figures of Steps 5-8 are specs too; they were only shown in the notebook,
+# and are now saved with the "exploratory" figure set.
+# (Figure size 14x7, "Set1" palette, "ticks" style and "talk" context, as before)
 
 # Create Barplot
-f1, ax1 = plt.subplots(figsize=(14,7))
-sns.barplot(data=df2, x="Country", y="GDPinTrillions")
-ax1.set_xlabel("Country")
-ax1.set_ylabel("GDP in Trillions of U.S. Dollars") # The data are not clearly labeled in the data file, so I'm assuming US Dollars based on World Bank link.
-ax1.set_title("Gross Domestic Product (GDP) by Country")
+# The data are not clearly labeled in the data file, so I'm assuming US Dollars based on World Bank link.
+STEP5_GDP = FigureSpec("Step5_Barplot_GDP.png", "bar", x="Country", y="GDPinTrillions",
+                       xlabel="Country", ylabel="GDP in Trillions of U.S. Dollars",
+                       title="Gross Domestic Product (GDP) by Country", figsize=(14, 7))
 #fmt = '${x:,.0f}'
 #tick = mtick.StrMethodFormatter(fmt)
 #ax1.yaxis.set_major_formatter(tick)
 
-plt.show()
-
 
 # B) Create a bar chart using the data in `df` with `Country` on the x-axis and `LEABY` on the y-axis.
 # Remember to `plt.show()` your chart!
@@ -170,21 +247,10 @@ plt.show()
 # In[16]:
 
 
-# Set color palette
-sns.set_palette("Set1")
-
-# Set style
-sns.set_style("ticks")
-sns.set_context("talk")
-
 # Create Barplot
-f2, ax2 = plt.subplots(figsize=(14,7))
-sns.barplot(data=df2, x="Country", y="LEABY")
-ax2.set_xlabel("Country")
-ax2.set_ylabel("Life Expectancy at Birth in Years")
-ax2.set_title("Life Expectancy by Country")
-
-plt.show()
+STEP5_LEABY = FigureSpec("Step5_Barplot_LEABY.png", "bar", x="Country", y="LEABY",
+                         xlabel="Country", ylabel="Life Expectancy at Birth in Years",
+                         title="Life Expectancy by Country", figsize=(14, 7))
 
 
 # What do you notice about the two bar charts? Do they look similar?
@@ -209,21 +275,10 @@ plt.show()
 
 #fig = plt.subplots(figsize=(15, 10)) 
 
-# Set color palette
-sns.set_palette("Set1")
-
-# Set style
-sns.set_style("ticks")
-sns.set_context("talk")
-
-# Create Barplot
-f3, ax3 = plt.subplots(figsize=(14,7))
-sns.violinplot(data=df2, x="Country", y="LEABY")
-ax3.set_xlabel("Country")
-ax3.set_ylabel("Life Expectancy at Birth in Years")
-ax3.set_title("Violin Plots: Life Expectancy by Country")
-
-plt.show()
+# Create Violinplot
+STEP6_VIOLIN = FigureSpec("Step6_Violinplot_LEABY.png", "violin", x="Country", y="LEABY",
+                          xlabel="Country", ylabel="Life Expectancy at Birth in Years",
+                          title="Violin Plots: Life Expectancy by Country", figsize=(14, 7))
 
 
 # What do you notice about this distribution? Which country's life expactancy has changed the most?
@@ -253,15 +308,13 @@ plt.show()
 # In[33]:
 
 
-f, ax = plt.subplots(figsize=(14,7)) 
+# Legend to the right of the plot
+legend_beside = (("loc", "center left"), ("bbox_to_anchor", (1, 0.5)), ("ncol", 1))
 
-ax4 = sns.barplot(data=df2, x="Country", y="GDPinTrillions", hue="Year")
-plt.xlabel("Country")
-plt.ylabel("GDP in Trillions of U.S. Dollars")
-plt.title("Change in GDP by Country (2000-2015)")
-plt.legend(loc='center left', bbox_to_anchor=(1, 0.5), ncol=1)
-
-plt.show()
+STEP7_GDP = FigureSpec("Step7_Barplot_GDP_by_Year.png", "grouped_bar", x="Country", y="GDPinTrillions",
+                       hue="Year", xlabel="Country", ylabel="GDP in Trillions of U.S. Dollars",
+                       title="Change in GDP by Country (2000-2015)", figsize=(14, 7),
+                       legend=legend_beside)
 
 
 # Now that we have plotted a barplot that clusters GDP over time by Country, let's do the same for Life Expectancy.
@@ -274,15 +327,10 @@ plt.show()
 # In[34]:
 
 
-f, ax = plt.subplots(figsize=(14,7)) 
-
-ax4 = sns.barplot(data=df2, x="Country", y="LEABY", hue="Year")
-plt.xlabel("Country")
-plt.ylabel("Life Expectancy at Birth in Years")
-plt.title("Change in Life Expectancy by Country (2000-2015)")
-plt.legend(loc='center left', bbox_to_anchor=(1, 0.5), ncol=1)
-
-plt.show()
+STEP7_LEABY = FigureSpec("Step7_Barplot_LEABY_by_Year.png", "grouped_bar", x="Country", y="LEABY",
+                         hue="Year", xlabel="Country", ylabel="Life Expectancy at Birth in Years",
+                         title="Change in Life Expectancy by Country (2000-2015)", figsize=(14, 7),
+                         legend=legend_beside)
 
 
 # What are your first impressions looking at the visualized data?
@@ -306,6 +354,11 @@ plt.show()
 
 # Country Comparison: Look at the slope of the change
 
+# The aggregate stage puts numbers on these answers (see changes.py): changes.csv has each
+# country's change, percentage change and CAGR from 2000 to 2015 plus its largest
+# year-over-year rise and fall, and largest_yearly_changes.csv ranks the country-years with
+# the biggest year-over-year changes
+
 # Relationship: There appears to be a positive correlation between GDP and Life Expectancy, at least within each country
 
 # Possible Reason 1: As people live longer, the members of that country can be more productive
@@ -342,13 +395,15 @@ plt.show()
 # "LEABY" 
 # plt.scatter
 
-# Set style
-sns.set_style("ticks")
-sns.set_context("notebook")
+# Small multiples instead of sns.FacetGrid: the rows are partitioned by Year once and each
+# panel is drawn as a single scatter collection (see facets.py). With hundreds of panels,
+# --panels-per-page (the specs' `panels_per_page`) splits them over several pages, saved as
+# Step8_FacetGrid_Scatter_p01.png, _p02.png, ...
+# Set style: "ticks" with the "notebook" context
+STEP8_SCATTER = FigureSpec("Step8_FacetGrid_Scatter.png", "scatter", x="GDPinTrillions", y="LEABY",
+                           hue="Country", facet="Year", col_wrap=4, height=2, context="notebook")
 
-# Uncomment the code below and fill in the blanks
-g = sns.FacetGrid(df2, col="Year", hue="Country", col_wrap=4, height=2)
-g = (g.map(plt.scatter, "GDPinTrillions", "LEABY", edgecolor="w").add_legend())
+EXPLORATORY_FIGURES = [STEP5_GDP, STEP5_LEABY, STEP6_VIOLIN, STEP7_GDP, STEP7_LEABY, STEP8_SCATTER]
 
 
 # + Which country moves the most along the X axis over the years?
@@ -367,6 +422,10 @@ g = (g.map(plt.scatter, "GDPinTrillions", "LEABY", edgecolor="w").add_legend())
 
 # No, these scatterplots would not be easily interpreted by the casual reader
 
+# Correlation in numbers rather than by eye: the aggregate stage saves Pearson and Spearman r
+# and the slope of LEABY on log10(GDP), per country plus all countries pooled, and a 5-year
+# rolling Pearson r (see correlation.py)
+
 
 # ## Step 9. Line Plots for Life Expectancy
 
@@ -395,15 +454,10 @@ g = (g.map(plt.scatter, "GDPinTrillions", "LEABY", edgecolor="w").add_legend())
 # "Year"
 # "Country"
 
-# Reset Context
-talk_rc = {'lines.linewidth': 5}                  
-sns.set_context("talk", rc = talk_rc) 
-
-# Uncomment the code below and fill in the blanks
-g3 = sns.FacetGrid(df2, col="Country", col_wrap=3, height=4)
-g3 = (g3.map(plt.plot, "Year", "LEABY").add_legend())
-plt.savefig("Figure_Appendix_A_FacetGrid_LEABY.png")
-plt.show()
+# Small multiples by Country, one line collection per panel, rendered and cached like the
+# Step 12 figures. The "talk" context with thick lines is part of the spec.
+APPENDIX_A = FigureSpec("Figure_Appendix_A_FacetGrid_LEABY.png", "line", x="Year", y="LEABY",
+                        facet="Country", col_wrap=3, height=4, rc=(("lines.linewidth", 5),))
 
 
 # What are your first impressions looking at the visualized data?
@@ -431,15 +485,12 @@ plt.show()
 # "Year"
 # "Country"
 
-# Reset Context
-talk_rc = {'lines.linewidth': 5}                  
-sns.set_context("talk", rc = talk_rc) 
+# Same small multiples for GDP, in green
+APPENDIX_B = FigureSpec("Figure_Appendix_B_FacetGrid_GDP.png", "line", x="Year", y="GDPinTrillions",
+                        facet="Country", col_wrap=3, height=4, rc=(("lines.linewidth", 5),),
+                        color="green")
 
-# Uncomment the code below and fill in the blanks
-g4 = sns.FacetGrid(df2, col="Country", col_wrap=3, height=4)
-g4 = (g4.map(plt.plot, "Year", "GDPinTrillions", color="green").add_legend())
-plt.savefig("Figure_Appendix_B_FacetGrid_GDP.png")
-plt.show()
+APPENDIX_FIGURES = [APPENDIX_A, APPENDIX_B]
 
 
 # Which countries have the highest and lowest GDP?
@@ -471,7 +522,7 @@ plt.show()
 
 # Zimbabwe has one of the lowest Life Expectancies in the world (Source: )
 # According to the Financial Times, Zimbabwe saw a dramatic increase in Life Expectancy, up between 35-40%
-link.txt(https://www.ft.com/content/38c2ad3e-0874-11e6-b6d3-746f8e9cdd33)
+# link.txt(https://www.ft.com/content/38c2ad3e-0874-11e6-b6d3-746f8e9cdd33)
 
 # Proposed reasons include a commodity boom after the 2008 financial crisis, which led to increased economic growth,
 # as well as Governmental and Non-Profit led improvements in the nation's health care system.
@@ -503,74 +554,114 @@ link.txt(https://www.ft.com/content/38c2ad3e-0874-11e6-b6d3-746f8e9cdd33)
 # In[109]:
 
 
-#fig = plt.subplots(figsize=(15, 10)) 
-
-# Set color palette for Plots
-sns.set_palette("Set1")
-
-
-# Set style and basic context for Plots
-sns.set_style("ticks")
-sns.set_context("talk")
-
-
-# VIOLIN PLOT: Life Expectancy by Country
-f7, ax7 = plt.subplots(figsize=(9,6))
-sns.violinplot(data=df2, x="Country", y="LEABY")
-ax7.set_xlabel("Country")
-ax7.set_ylabel("Life Expectancy at Birth in Years")
-ax7.set_title("Violin Plots: Life Expectancy by Country")
-plt.savefig("Figure_A_Violinplot_LEABY.png")
-plt.show()
-
-
-# Reset Context: Thicken Line for Line Plots Figure B and C
-talk_rc = {'lines.linewidth': 5}                  
-sns.set_context("talk", rc = talk_rc) 
-
-# LINE PLOT: Change in Life Expectancy by Country (2000-2015)
-
-f9, ax8 = plt.subplots(figsize=(9,6)) 
-
-ax8 = sns.lineplot(data=df2, x="Year", y="LEABY", hue="Country")
-ax8.set_xlabel("Year")
-ax8.set_ylabel("Life Expectancy at Birth in Years")
-ax8.set_title("Change in Life Expectancy by Country (2000-2015)")
-ax8.legend(loc='center left', bbox_to_anchor=(1, 0.75), ncol=1)
-ax8.set_ylim(37.5,87)
-plt.savefig("Figure_B_Lineplot_LEABY.png")
-plt.show()
-
-
-# LINE PLOT: Change in GDP by Country (2000-2015)
-
-f9, ax9 = plt.subplots(figsize=(9,6)) 
-
-ax9 = sns.lineplot(data=df2, x="Year", y="GDPinTrillions", hue="Country")
-ax9.set_xlabel("Year")
-ax9.set_ylabel("GDP in Trillions of U.S. Dollars")
-ax9.set_title("Change in GDP by Country (2000-2015)")
-ax9.legend(loc='center left', bbox_to_anchor=(1, 0.75), ncol=1)
-ax9.set_ylim(-2.5,25)
-plt.savefig("Figure_C_Lineplot_GDP.png")
-plt.show()
-
-# LINE PLOT: Change in GDP in Zimbabwe (2000-2015)
-# Reset Context for Thicker Line for Zimbabwe Inset Graph
-talk_rc = {'lines.linewidth': 15}                  
-sns.set_context("talk", rc = talk_rc)
-
-# Line Plot
-f10, ax10 = plt.subplots(figsize=(9,6)) 
-
-ax10 = sns.lineplot(data=df2, x="Year", y="GDPinTrillions", hue="Country")
-ax10.set_xlabel("Year")
-ax10.set_ylabel("GDP in Trillions of U.S. Dollars")
-ax10.set_title("Change in GDP in Zimbabwe (2000-2015)")
-ax10.legend(loc='center left', bbox_to_anchor=(1, 0.75), ncol=1)
-ax10.set_ylim(0,.02)
-plt.savefig("Figure_Cinset_Lineplot_GDP_Zimbabwe.png")
-plt.show()
+# Each blog-post figure is declared as a spec: plot type, columns, labels, limits and style.
+# render_specs draws them headless in a process pool and saves the PNGs (see render.py).
+# Style is scoped to each figure, so the old set_palette/set_style/set_context calls
+# between figures are now the palette/style/context/rc fields of each spec
+# ("Set1", "ticks" and "talk" unless a spec says otherwise).
+# downsample=True reduces each line to at most 4 points per pixel column before drawing,
+# which keeps monthly or quarterly series cheap to render (see downsample.py).
+
+# Legend to the right of the plot, as in the line plots below
+legend_right = (("loc", "center left"), ("bbox_to_anchor", (1, 0.75)), ("ncol", 1))
+
+BLOG_FIGURES = [
+    # VIOLIN PLOT: Life Expectancy by Country
+    FigureSpec("Figure_A_Violinplot_LEABY.png", "violin", x="Country", y="LEABY",
+               xlabel="Country", ylabel="Life Expectancy at Birth in Years",
+               title="Violin Plots: Life Expectancy by Country"),
+
+    # LINE PLOT: Change in Life Expectancy by Country (2000-2015)
+    # Thicken Line for Line Plots Figure B and C
+    FigureSpec("Figure_B_Lineplot_LEABY.png", "line", x="Year", y="LEABY", hue="Country",
+               xlabel="Year", ylabel="Life Expectancy at Birth in Years",
+               title="Change in Life Expectancy by Country (2000-2015)",
+               ylim=(37.5, 87), rc=(("lines.linewidth", 5),), legend=legend_right,
+               downsample=True),
+
+    # LINE PLOT: Change in GDP by Country (2000-2015)
+    FigureSpec("Figure_C_Lineplot_GDP.png", "line", x="Year", y="GDPinTrillions", hue="Country",
+               xlabel="Year", ylabel="GDP in Trillions of U.S. Dollars",
+               title="Change in GDP by Country (2000-2015)",
+               ylim=(-2.5, 25), rc=(("lines.linewidth", 5),), legend=legend_right,
+               downsample=True),
+
+    # LINE PLOT: Change in GDP in Zimbabwe (2000-2015)
+    # Thicker Line for Zimbabwe Inset Graph
+    FigureSpec("Figure_Cinset_Lineplot_GDP_Zimbabwe.png", "line", x="Year", y="GDPinTrillions", hue="Country",
+               xlabel="Year", ylabel="GDP in Trillions of U.S. Dollars",
+               title="Change in GDP in Zimbabwe (2000-2015)",
+               ylim=(0, .02), zoom=("Zimbabwe",), rc=(("lines.linewidth", 15),), legend=legend_right,
+               downsample=True),
+]
+
+FIGURE_SETS = {
+    "exploratory": EXPLORATORY_FIGURES,
+    "appendix": APPENDIX_FIGURES,
+    "blog": BLOG_FIGURES,
+}
+
+
+def render(data, out_dir=".", figure_sets=("appendix", "blog"), processes=None, cache=True, formats=(),
+           swaps=(), registry=None, data_dir=".", raster=None, exports=None, summaries=None,
+           panels_per_page=None):
+    """Stage "render": save the chosen figure sets to `out_dir` and return the paths.
+
+    Figures whose data, spec and plotting code haven't changed are linked back from the
+    figure cache instead of being drawn again (see figure_cache.py). `formats` adds SVG/PDF
+    copies of each figure; files are encoded and written in the background (see export.py).
+    Each (measure, indicator) pair in `swaps` also saves the figures of `measure` drawn with
+    that registered indicator instead (see indicators.py). `raster` ("points" or "density")
+    rasterises the data layer of the small multiples (see facets.py); a list passed as
+    `exports` gets the size and save time of every file written. The bar and line figures
+    draw from the summaries in `summaries` (a `summary.Summaries`) where it has them.
+    `panels_per_page` splits the small multiples over pages, one file each.
+    """
+    specs = [spec for name in figure_sets for spec in FIGURE_SETS[name]]
+    if raster:
+        specs = rasterised(specs, raster)
+    if panels_per_page:
+        specs = paginated(specs, panels_per_page)
+    figure_cache = FigureCache(os.path.join(out_dir, ".figure_cache")) if cache else None
+    paths = render_specs(specs, data, out_dir=out_dir, processes=processes, cache=figure_cache,
+                         formats=formats, exports=exports, summaries=summaries)
+    if swaps:
+        joined = join([indicator for _, indicator in swaps], data_dir, registry, panel=as_panel(data))
+        swapped = [spec for measure, indicator in swaps
+                   for spec in for_indicator(specs, measure, indicator, label(indicator, registry))]
+        paths += render_specs(swapped, joined, out_dir=out_dir, processes=processes, cache=figure_cache,
+                              formats=formats, exports=exports)
+    return paths
+
+
+def update(new_path, out_dir=".", data_path="all_data.csv"):
+    """Stage "update": fold the country-years in `new_path` into the store in `<out_dir>/.state`.
+
+    The first update seeds the store from `data_path`. Returns the store and the countries
+    that changed; history is never re-read after that. The per-Country summary of the store
+    is saved as summary_by_country_running.csv: its CIs use the normal approximation, so it
+    doesn't replace the bootstrapped summary_by_country.csv of the aggregate stage. Raises
+    ValueError for rows that are duplicated or already in the store.
+    """
+    store = IncrementalStore(os.path.join(out_dir, ".state"))
+    if store.panel is None:
+        store.update(normalise(load(data_path)))
+    changed, _ = store.update(normalise(load_all_data(new_path, cache=False)))
+    store.summary(["Country"]).to_csv(os.path.join(out_dir, "summary_by_country_running.csv"))
+    return store, changed
+
+
+def render_stale(store, changed, out_dir=".", figure_sets=("appendix", "blog"), processes=None, cache=True,
+                 formats=(), raster=None, exports=None, panels_per_page=None):
+    """Re-render only the figures that draw a changed country, from the stored panel."""
+    specs = stale([spec for name in figure_sets for spec in FIGURE_SETS[name]], changed)
+    if raster:
+        specs = rasterised(specs, raster)
+    if panels_per_page:
+        specs = paginated(specs, panels_per_page)
+    figure_cache = FigureCache(os.path.join(out_dir, ".figure_cache")) if cache else None
+    return render_specs(specs, store.panel, out_dir=out_dir, processes=processes, cache=figure_cache,
+                        formats=formats, exports=exports)
 
 
 # In[ ]:
@@ -580,3 +671,203 @@ plt.show()
 
 # Note to Reviewer: As an academic and given the quality of the datasets we needed to use to complete the assignment, I did not feel comfortable posting to a blog hosting site like Medium. The analyses above are legitimate as far as they go, but the datasets -- and thus the analyses -- are not nuanced enough for public consumption
 
+
+
+# ## Command line
+#
+# python life_expectancy_gdp.py [--data all_data.csv] [--out-dir .] [--stages load,normalise,aggregate,render]
+#                               [--figures appendix,blog] [--processes N] [--no-cache] [--report timings.json]
+#                               [--update new_year.csv] [--compact] [--formats svg,pdf]
+#                               [--indicators indicators.csv] [--plot LEABY=health_spending ...]
+#                               [--backend arrow|duckdb] [--raster points|density]
+#                               [--stream [--chunksize N]] [--panels-per-page N]
+#
+# With --update, only the new country-years are read: they are folded into the running
+# aggregates and panel kept in <out-dir>/.state (see incremental.py), and only the figures
+# showing a changed country are redrawn. The other stages are skipped. An update with
+# duplicate country-years, or country-years already folded in, stops with an error and
+# leaves the store as it was.
+#
+# --indicators adds a registry table of other indicator files (name,path,column,label,...,
+# see indicators.py) to the measures of all_data.csv. Each --plot MEASURE=INDICATOR also saves
+# every figure of MEASURE (LEABY, GDPinTrillions or GDP) drawn with INDICATOR instead; the
+# indicators are joined onto df2's (Country x Year) panel without any merges.
+#
+# --backend answers the analysis from Parquet on disk instead of an in-memory df2 (see query.py):
+# --data is a Parquet file or folder, or a CSV that gets a Parquet copy next to it (named
+# after a hash of the CSV's contents). The normalise steps and the Country/Year filters are
+# pushed into the scans, and only the summaries and the (Country x Year) panel the figures
+# draw from are loaded; the panel is queried once, in the aggregate stage.
+#
+# --raster rasterises the data layer of the small multiples (the Step 8 scatter pages and the
+# appendix facets) so SVG/PDF exports stay small; "density" bins dense scatter panels into a
+# 2-D histogram image. Axes, labels and legends stay vectors either way. The render stage
+# reports files, bytes and save seconds per format.
+#
+# --panels-per-page N splits each set of small multiples over pages of N panels, saved as
+# <figure>_p01.png, <figure>_p02.png, ... and cached page by page.
+#
+# --stream reads --data in chunks of --chunksize rows and keeps only the running aggregates
+# per Country and per Country/Year, never the whole frame (see streaming.py). The summary
+# tables and the bar and line figures come from them (normal-approximation CIs); the other
+# tables and figures read the (Country x Year) panel of their means.
+#
+# --compact keeps df2 in compact dtypes without the GDPinTrillions column. The normalise
+# stage reports the bytes saved per column against the notebook's layout either way.
+#
+# Each stage runs inside instrumentation (wall time, peak RSS, rows/sec) and the report is
+# printed and saved as JSON, so runs can be compared from one revision to the next.
+
+STAGES = ["load", "normalise", "aggregate", "render"]
+
+# A stage also runs the stages it needs
+NEEDS = {"load": [], "normalise": ["load"], "aggregate": ["load", "normalise"], "render": ["load", "normalise"]}
+
+
+def comma_list(text):
+    return [item.strip() for item in text.split(",") if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="GDP and life expectancy analysis and figures.")
+    parser.add_argument("--data", default="all_data.csv", help="input CSV (default: all_data.csv)")
+    parser.add_argument("--out-dir", default=".", help="where figures, tables and the report go")
+    parser.add_argument("--stages", type=comma_list, default=STAGES,
+                        help="comma-separated stages to run: %s (default: all)" % ",".join(STAGES))
+    parser.add_argument("--figures", type=comma_list, default=["appendix", "blog"],
+                        help="comma-separated figure sets to render: %s (default: appendix,blog)"
+                        % ",".join(FIGURE_SETS))
+    parser.add_argument("--processes", type=int, default=None, help="render processes (default: one per CPU)")
+    parser.add_argument("--no-cache", action="store_true", help="re-render every figure")
+    parser.add_argument("--formats", type=comma_list, default=[],
+                        help="comma-separated extra formats to save each figure in, e.g. svg,pdf")
+    parser.add_argument("--report", default=None,
+                        help="JSON report path (default: <out-dir>/timings.json, '-' for stdout only)")
+    parser.add_argument("--compact", action="store_true",
+                        help="compact df2: narrow dtypes, GDPinTrillions derived on read; reports bytes saved")
+    parser.add_argument("--update", default=None,
+                        help="CSV of new country-years to fold into the stored aggregates and panel")
+    parser.add_argument("--indicators", default=None,
+                        help="registry table of extra indicator files (name,path,column,label,...)")
+    parser.add_argument("--plot", action="append", default=[], metavar="MEASURE=INDICATOR",
+                        help="also save the figures of MEASURE drawn with a registered INDICATOR")
+    parser.add_argument("--raster", choices=["points", "density"], default=None,
+                        help="rasterise the data layer of the small multiples (density: as a 2-D histogram)")
+    parser.add_argument("--panels-per-page", type=int, default=None, metavar="N",
+                        help="split the small multiples over pages of N panels, one file per page")
+    parser.add_argument("--backend", default=None, metavar="ENGINE",
+                        help="query Parquet on disk instead of loading the data: arrow or duckdb (needs pyarrow)")
+    parser.add_argument("--stream", action="store_true",
+                        help="aggregate the CSV chunk by chunk instead of loading it (see --chunksize)")
+    parser.add_argument("--chunksize", type=int, default=1000000, help="rows per chunk with --stream")
+    args = parser.parse_args(argv)
+    if args.stream and args.backend:
+        parser.error("--stream and --backend are alternatives: choose one")
+    if args.backend:
+        # Imported only here: the engines are slow to import and most runs don't need them
+        query = importlib.import_module("query")
+        if args.backend not in query.available_engines():
+            parser.error("query engine %r isn't available here (available: %s)"
+                         % (args.backend, ", ".join(query.available_engines()) or "none, install pyarrow"))
+    args.registry = dict(INDICATORS)
+    if args.indicators:
+        args.registry.update(load_registry(args.indicators))
+    args.swaps = []
+    for swap in args.plot:
+        measure, _, indicator = swap.partition("=")
+        if measure not in INDICATORS or indicator not in args.registry:
+            parser.error("--plot takes MEASURE=INDICATOR with MEASURE one of %s and a registered INDICATOR, not %r"
+                         % (", ".join(INDICATORS), swap))
+        args.swaps.append((measure, indicator))
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error("unknown stage %r (choose from %s)" % (stage, ", ".join(STAGES)))
+    for name in args.figures:
+        if name not in FIGURE_SETS:
+            parser.error("unknown figure set %r (choose from %s)" % (name, ", ".join(FIGURE_SETS)))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.out_dir, exist_ok=True)
+    wanted = set(args.stages)
+    for stage in args.stages:
+        wanted.update(NEEDS[stage])
+
+    report = Report(data=args.data, stages_requested=args.stages, import_s=round(IMPORT_S, 6))
+    if args.update:
+        wanted = set()
+        with report.stage("update") as stage:
+            try:
+                store, changed = update(args.update, args.out_dir, args.data)
+            except ValueError as error:
+                raise SystemExit("error: can't apply --update %s: %s" % (args.update, error))
+            stage.extra["countries_changed"] = len(changed)
+        with report.stage("render") as stage:
+            exports = []
+            paths = render_stale(store, changed, args.out_dir, args.figures, args.processes,
+                                 cache=not args.no_cache, formats=args.formats, raster=args.raster,
+                                 exports=exports, panels_per_page=args.panels_per_page)
+            stage.extra["figures"] = len(paths)
+            stage.extra["exports"] = export_totals(exports)
+
+    df = df2 = source = streamed = aggregated = None
+    if args.backend or args.stream:
+        wanted.discard("normalise")  # done in the scans, or chunk by chunk
+    if "load" in wanted:
+        with report.stage("load") as stage:
+            if args.stream:
+                streamed = stream_aggregates(args.data, args.chunksize)
+                stage.extra["groups"] = {" x ".join(keys): len(table) for keys, table in streamed.items()}
+            elif args.backend:
+                source = importlib.import_module("query").open_source(args.data, args.backend)
+                stage.rows = source.count_rows()
+                stage.extra["engine"] = source.engine
+            else:
+                df = load(args.data)
+                stage.rows = len(df)
+    if "normalise" in wanted:
+        with report.stage("normalise") as stage:
+            df2 = normalise(df, compact_frame=args.compact)
+            stage.rows = len(df2)
+            saved = memory_report(df2)["saved_bytes"]
+            stage.extra["bytes_saved"] = {column: int(size) for column, size in saved.items()}
+    if "aggregate" in wanted:
+        with report.stage("aggregate") as stage:
+            aggregated = aggregate(df2, args.out_dir, source, streamed)
+            if streamed is None:
+                stage.rows = source.count_rows() if source is not None else len(df2)
+    if "render" in wanted:
+        with report.stage("render") as stage:
+            summaries = None
+            if streamed is not None:
+                data = aggregated["panel"] if aggregated else summary_panel(streamed[("Country", "Year")])
+                summaries = Summaries()
+                for keys, table in streamed.items():
+                    summaries.add(keys, table)
+            elif source is not None:
+                # The aggregate stage's panel, so the dataset is only scanned for it once
+                data = aggregated["panel"] if aggregated else source.panel()
+                stage.rows = source.count_rows()
+            else:
+                data = df2
+                stage.rows = len(df2)
+            exports = []
+            paths = render(data, args.out_dir, args.figures, args.processes, cache=not args.no_cache,
+                           formats=args.formats, swaps=args.swaps, registry=args.registry,
+                           data_dir=os.path.dirname(args.data), raster=args.raster, exports=exports,
+                           summaries=summaries, panels_per_page=args.panels_per_page)
+            stage.extra["figures"] = len(paths)
+            stage.extra["exports"] = export_totals(exports)
+
+    result = report.as_dict()
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    if args.report != "-":
+        report.write(args.report or os.path.join(args.out_dir, "timings.json"))
+    return result
+
+
+if __name__ == "__main__":
+    main()
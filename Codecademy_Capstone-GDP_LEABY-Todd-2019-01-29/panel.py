@@ -0,0 +1,151 @@
+# coding: utf-8
+
+# # Wide (Country x Year) panel
+#
+# The analysis steps kept re-filtering the long-format `df2` by Country and Year with
+# boolean masks and groupbys. `Panel` pivots each measure once into a contiguous 2-D float
+# array: row = country code, column = year offset from the first year, NaN for gaps.
+# Selecting a country, a range of years or a single year is then a NumPy view, not a scan.
+# `to_long` turns a panel (or a selection of it) back into the long format the plots read.
+
+import numpy as np
+import pandas as pd
+
+from compact import has_measure, measure_values
+
+
+MEASURES = ("GDP", "GDPinTrillions", "LEABY")
+
+
+class Panel(object):
+    """Measures as (country x year) arrays, with the country and year labels."""
+
+    def __init__(self, countries, first_year, arrays):
+        self.countries = pd.Index(countries, name="Country")
+        self.first_year = int(first_year)
+        self.arrays = arrays
+        self.row = {country: i for i, country in enumerate(self.countries)}
+
+    @classmethod
+    def from_long(cls, df, measures=MEASURES, country="Country", year="Year"):
+        """Pivot the long-format frame once: one pass of `np.bincount` per measure, no groupby.
+
+        Rows with no Country are left out. Several rows for one Country/Year (sub-annual data)
+        are averaged, ignoring missing values, as `query.ParquetSource.panel` does.
+        """
+        codes, countries = pd.factorize(df[country], sort=True)
+        keep = codes >= 0
+        years = df[year].to_numpy()[keep]
+        first_year = int(years.min())
+        n_years = int(years.max()) - first_year + 1
+        keys = codes[keep] * n_years + (years - first_year)
+        size = len(countries) * n_years
+        arrays = {}
+        for measure in measures:
+            values = measure_values(df, measure)[keep]
+            present = ~np.isnan(values)
+            sums = np.bincount(keys[present], weights=values[present], minlength=size)
+            counts = np.bincount(keys[present], minlength=size)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                arrays[measure] = (sums / counts).reshape(len(countries), n_years)
+        return cls(np.asarray(countries), first_year, arrays)
+
+    @property
+    def years(self):
+        return np.arange(self.first_year, self.first_year + self.shape[1])
+
+    @property
+    def shape(self):
+        return next(iter(self.arrays.values())).shape
+
+    def __getitem__(self, measure):
+        return self.arrays[measure]
+
+    def __contains__(self, measure):
+        return measure in self.arrays
+
+    def column(self, year):
+        return year - self.first_year
+
+    def country(self, name, measure):
+        """One country's series for `measure` (a view)."""
+        return self.arrays[measure][self.row[name]]
+
+    def cross_section(self, year, measure):
+        """Every country's value for `measure` in `year` (a view)."""
+        return self.arrays[measure][:, self.column(year)]
+
+    def years_between(self, start, stop):
+        """Panel of the years `start` to `stop` inclusive; the arrays are views."""
+        columns = slice(self.column(start), self.column(stop) + 1)
+        return Panel(self.countries, start, {m: a[:, columns] for m, a in self.arrays.items()})
+
+    def select(self, countries):
+        """Panel of just `countries` (in the given order)."""
+        rows = [self.row[name] for name in countries]
+        return Panel(self.countries[rows], self.first_year, {m: a[rows] for m, a in self.arrays.items()})
+
+    def updated(self, df):
+        """New panel with the rows of long-format `df` written in.
+
+        Countries and years not yet in the panel are added (the arrays grow, other cells stay
+        NaN). Existing cells are overwritten. Costs O(panel size + rows of `df`).
+        """
+        countries = self.countries.union(pd.Index(df["Country"].unique()).astype(object), sort=True)
+        years = df["Year"].to_numpy()
+        first_year = min(self.first_year, int(years.min()))
+        last_year = max(self.first_year + self.shape[1] - 1, int(years.max()))
+        rows = countries.get_indexer(self.countries)
+        columns = slice(self.first_year - first_year, self.first_year - first_year + self.shape[1])
+        new_rows = countries.get_indexer(df["Country"].astype(object))
+        new_columns = years - first_year
+        arrays = {}
+        for measure, old in self.arrays.items():
+            array = np.full((len(countries), last_year - first_year + 1), np.nan)
+            array[rows, columns] = old
+            if measure in df:
+                array[new_rows, new_columns] = df[measure].to_numpy(dtype=np.float64)
+            arrays[measure] = array
+        return Panel(countries, first_year, arrays)
+
+    def save(self, path):
+        """Write the panel to a .npz file."""
+        np.savez(path, countries=np.asarray(self.countries, dtype=str), first_year=self.first_year,
+                 measures=np.asarray(list(self.arrays), dtype=str), **self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Read a panel written by `save`."""
+        with np.load(path) as stored:
+            arrays = {str(measure): stored[str(measure)] for measure in stored["measures"]}
+            return cls(stored["countries"].astype(object), int(stored["first_year"]), arrays)
+
+    def to_long(self, countries=None, measures=None):
+        """Long-format frame (Country, Year, measures...) for the plot steps.
+
+        Country-years where every selected measure is missing are left out, so a panel built
+        from `df2` gives back the same rows (sorted by Country, then Year).
+        """
+        panel = self if countries is None else self.select(countries)
+        measures = list(panel.arrays) if measures is None else list(measures)
+        n_countries, n_years = panel.shape
+        values = {m: panel.arrays[m].ravel() for m in measures}
+        present = np.zeros(n_countries * n_years, dtype=bool)
+        for column in values.values():
+            present |= ~np.isnan(column)
+
+        long = {
+            "Country": pd.Categorical.from_codes(np.repeat(np.arange(n_countries), n_years)[present],
+                                                 categories=panel.countries),
+            "Year": np.tile(panel.years, n_countries)[present],
+        }
+        for measure, column in values.items():
+            long[measure] = column[present]
+        return pd.DataFrame(long)
+
+
+def as_panel(data, measures=MEASURES):
+    """`data` as a Panel: panels pass through, long-format frames are pivoted."""
+    if isinstance(data, Panel):
+        return data
+    return Panel.from_long(data, measures=[m for m in measures if has_measure(data, m)])
@@ -0,0 +1,166 @@
+# coding: utf-8
+
+# # Plots drawn from precomputed summaries
+#
+# These replace `sns.barplot`, `sns.lineplot` and `sns.violinplot` on raw rows. Bars and
+# lines take a summary frame from `summary.summarise` (or `streaming.stream_aggregates`) and
+# draw the means and confidence intervals with plain matplotlib, so nothing is recomputed per
+# figure. Violins are drawn from the binned densities of density.py.
+# Colours come from the active colour cycle, so `sns.set_palette("Set1")` still applies.
+
+import colorsys
+
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+from matplotlib import ticker
+from matplotlib.colors import to_rgb
+
+from downsample import m4_indices
+
+
+# Error bar look matching seaborn's default
+ERROR_COLOR = ".26"
+
+
+def palette(n):
+    """First `n` colours of the active colour cycle (repeating if needed)."""
+    colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+    return [colors[i % len(colors)] for i in range(n)]
+
+
+class ScaledFormatter(ticker.Formatter):
+    """Tick labels for an axis drawn in stored units but read in scaled ones (GDP in trillions).
+
+    Labels are the tick values divided by `scale`, with as few decimals as all ticks need.
+    """
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.decimals = 0
+
+    def set_locs(self, locs):
+        super().set_locs(locs)
+        scaled = np.asarray(locs, dtype=np.float64) / self.scale
+        self.decimals = next((d for d in range(7) if np.allclose(np.round(scaled, d), scaled)), 6)
+
+    def __call__(self, value, pos=None):
+        return "%.*f" % (self.decimals, value / self.scale)
+
+
+def ci_error(stats):
+    """(2, n) array of distances from the mean to the CI ends, for `errorbar`."""
+    return np.vstack([stats["mean"] - stats["ci_low"], stats["ci_high"] - stats["mean"]])
+
+
+def bar_from_summary(ax, summary, y, x="Country"):
+    """Bar per `x` group at the mean of `y`, with its CI as an error bar (like sns.barplot)."""
+    stats = summary[y]
+    labels = stats.index.get_level_values(x)
+    positions = np.arange(len(stats))
+    ax.bar(positions, stats["mean"], width=0.8, color=palette(len(stats)))
+    ax.errorbar(positions, stats["mean"], yerr=ci_error(stats), fmt="none",
+                ecolor=ERROR_COLOR, elinewidth=plt.rcParams["lines.linewidth"] * 1.8)
+    ax.set_xticks(positions)
+    ax.set_xticklabels(labels)
+    ax.set_xlim(-0.5, len(stats) - 0.5)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    return ax
+
+
+def grouped_bar_from_summary(ax, summary, y, x="Country", hue="Year"):
+    """Bars per `x` group, dodged by `hue`, from a summary grouped by [x, hue] (like hue= in sns.barplot)."""
+    stats = summary[y]
+    groups = stats.index.get_level_values(x)
+    hues = stats.index.get_level_values(hue)
+    group_order = groups.unique()
+    hue_order = np.sort(hues.unique())
+    width = 0.8 / len(hue_order)
+    offset = (np.arange(len(hue_order)) - (len(hue_order) - 1) / 2) * width
+    group_position = dict(zip(group_order, range(len(group_order))))
+    hue_position = dict(zip(hue_order, range(len(hue_order))))
+
+    positions = (np.array([group_position[g] for g in groups])
+                 + offset[[hue_position[h] for h in hues]])
+    for level, color in zip(hue_order, palette(len(hue_order))):
+        rows = np.asarray(hues == level)
+        ax.bar(positions[rows], stats["mean"].to_numpy()[rows], width=width, color=color, label=level)
+    if stats["ci_low"].notna().any():
+        ax.errorbar(positions, stats["mean"], yerr=ci_error(stats), fmt="none",
+                    ecolor=ERROR_COLOR, elinewidth=plt.rcParams["lines.linewidth"] * 1.8)
+    ax.set_xticks(np.arange(len(group_order)))
+    ax.set_xticklabels(group_order)
+    ax.set_xlim(-0.5, len(group_order) - 0.5)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    ax.legend(title=hue)
+    return ax
+
+
+def line_from_summary(ax, summary, y, x="Year", hue="Country", band=True, pixels=None):
+    """Line of the mean of `y` over `x` per `hue` group, with a CI band (like sns.lineplot).
+
+    With `pixels` (the plot width in pixels), each line is first reduced to at most four
+    points per pixel column (see downsample.py), which rasterises to the same image.
+    """
+    stats = summary[y]
+    if pixels:
+        lines, _ = pd.factorize(stats.index.get_level_values(hue))
+        keep = m4_indices(lines, stats.index.get_level_values(x), stats["mean"], pixels)
+        stats = stats.iloc[keep]
+    levels = stats.index.get_level_values(hue).unique()
+    for level, color in zip(levels, palette(len(levels))):
+        group = stats.xs(level, level=hue)
+        xs = group.index.get_level_values(x)
+        ax.plot(xs, group["mean"], color=color, label=level)
+        if band and group["ci_low"].notna().any():
+            ax.fill_between(xs, group["ci_low"], group["ci_high"], color=color, alpha=0.2, linewidth=0)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    ax.legend(title=hue)
+    return ax
+
+
+def desaturate(color, proportion):
+    """`color` with its HLS saturation scaled by `proportion` (as seaborn's `saturation=`)."""
+    hue, lightness, saturation = colorsys.rgb_to_hls(*to_rgb(color))
+    return colorsys.hls_to_rgb(hue, lightness, saturation * proportion)
+
+
+def violin_from_densities(ax, densities, x="Country", y="LEABY", width=0.8, saturation=0.75):
+    """Violin per group from precomputed `density.Densities`, with an inner box (like sns.violinplot).
+
+    Each violin gets its own palette colour, as the bars do. Widths are scaled so every violin
+    has the same area, and each has a box from the quartiles, whiskers to 1.5 IQR and a white
+    median mark, as seaborn draws them.
+    """
+    colors = [desaturate(color, saturation) for color in palette(len(densities))]
+    gray = (min(colorsys.rgb_to_hls(*to_rgb(color))[1] for color in colors) * 0.6,) * 3
+    linewidth = 1.25 * plt.rcParams["patch.linewidth"]
+    box_width = linewidth * 4.5
+    with np.errstate(invalid="ignore"):
+        peak = np.nanmax(densities.density) if np.isfinite(densities.density).any() else 1.0
+    half_width = densities.density / peak * width / 2
+
+    positions = np.arange(len(densities))
+    for i in positions:
+        span = half_width[i]
+        present = ~np.isnan(span)
+        if not present.any():
+            # No spread (a single value): a flat line, as seaborn draws it
+            ax.plot([i - width / 2, i + width / 2], [densities.mean[i]] * 2, color=gray, linewidth=linewidth)
+            continue
+        ax.fill_betweenx(densities.grid[present], i - span[present], i + span[present],
+                         facecolor=colors[i], edgecolor=gray, linewidth=linewidth)
+        ax.plot([i, i], densities.whiskers[i], color=gray, linewidth=box_width / 3)
+        ax.plot([i, i], densities.quartiles[i, [0, 2]], color=gray, linewidth=box_width)
+        ax.plot([i], [densities.quartiles[i, 1]], marker="_", markersize=box_width / 1.2,
+                markeredgewidth=box_width / 5, markeredgecolor="w", markerfacecolor="w", color=gray)
+    ax.set_xticks(positions)
+    ax.set_xticklabels(densities.groups)
+    ax.xaxis.grid(False)
+    ax.set_xlim(-0.5, len(densities) - 0.5)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    return ax
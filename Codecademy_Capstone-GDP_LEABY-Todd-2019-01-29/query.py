@@ -0,0 +1,293 @@
+# coding: utf-8
+
+# # Out-of-core queries over Parquet
+#
+# Every analysis step works on the in-memory `df2`, so the data has to fit in RAM before the
+# first question ("what years are represented?") can be answered. `ParquetSource` answers the
+# same questions from Parquet files on disk instead, without loading them:
+#   - projection pushdown: only Country, Year and the measures asked for are read, and the
+#     Step 4 rename and the GDPinTrillions derivation happen in the scan's projection;
+#   - predicate pushdown: Country/Year filters go to the scanner, which skips row groups by
+#     their statistics;
+#   - the scan is multi-threaded (Arrow, or DuckDB if installed) and each batch is folded
+#     into the running aggregates of streaming.py, so memory holds one batch plus the groups.
+# Only the small results (distinct years, per-group statistics, a Country x Year panel of
+# means) become pandas objects. Country names are canonicalised on those results, which
+# costs O(groups); filters match every spelling in the alias table.
+#
+# pyarrow is optional, as for the Feather cache. DuckDB is optional too: with it, the
+# group-by itself runs in DuckDB's parallel hash aggregate.
+
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # No pyarrow: the in-memory pandas path is the only one
+    ds = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from compact import SCALED_MEASURES
+from countries import canonicalise_countries, spelling_keys
+from data_loader import LEABY_COLUMN, SCHEMA, file_digest
+from panel import Panel
+from streaming import COMBINE, STATISTICS, RunningAggregates, prepare_chunk
+
+
+ENGINES = ["arrow", "duckdb"]
+
+
+def available_engines():
+    """Query engines that can run here (DuckDB also needs pyarrow, for the dataset schema)."""
+    if ds is None:
+        return []
+    return ["arrow"] + (["duckdb"] if duckdb is not None else [])
+
+
+def convert_csv(csv_path, parquet_path, block_size=1 << 26, row_group_size=1 << 20):
+    """Write `csv_path` to a Parquet file, streaming it block by block.
+
+    The Step 4/5 rename and country canonicalisation are applied on the way (see
+    streaming.prepare_chunk), so the Parquet copy is already normalised. The file is written
+    to a temporary name and renamed into place once complete.
+    """
+    column_types = {column: pa.string() if dtype == "category" else pa.from_numpy_dtype(np.dtype(dtype))
+                    for column, dtype in SCHEMA.items()}
+    reader = pa_csv.open_csv(csv_path, read_options=pa_csv.ReadOptions(block_size=block_size),
+                             convert_options=pa_csv.ConvertOptions(column_types=column_types,
+                                                                   include_columns=list(SCHEMA)))
+    tmp = "%s.%d.tmp" % (parquet_path, os.getpid())
+    writer = None
+    try:
+        for batch in reader:
+            chunk = prepare_chunk(batch.to_pandas(categories=["Country"]), scaled=False)
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            table = table.set_column(0, "Country", table.column("Country").cast(pa.string()))
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, table.schema)
+            writer.write_table(table, row_group_size=row_group_size)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("%s has no data rows" % csv_path)
+    os.replace(tmp, parquet_path)
+    return parquet_path
+
+
+def parquet_copy(csv_path):
+    """Path of a Parquet copy of `csv_path` next to it: `<stem>.<contents hash>.parquet`.
+
+    Keyed on the CSV's contents like the Feather cache (see data_loader), so a replaced CSV
+    is converted again whatever its modification time. Copies of older versions are removed.
+    """
+    stem = os.path.splitext(csv_path)[0]
+    parquet_path = "%s.%s.parquet" % (stem, file_digest(csv_path))
+    if not os.path.exists(parquet_path):
+        pattern = re.compile(r"%s\.[0-9a-f]{32}\.parquet\Z" % re.escape(os.path.basename(stem)))
+        folder = os.path.dirname(os.path.abspath(csv_path))
+        for name in os.listdir(folder):
+            if pattern.match(name):
+                os.remove(os.path.join(folder, name))
+        convert_csv(csv_path, parquet_path)
+    return parquet_path
+
+
+def canonical_groups(stats, keys):
+    """Running statistics keyed on raw country spellings, re-keyed on canonical names.
+
+    Spellings of one country are combined like chunks are (see streaming.COMBINE).
+    """
+    columns = {}
+    if "Country" in keys:
+        frame = pd.DataFrame({"Country": pd.Categorical(stats["Country"].astype(object))})
+        columns["Country"] = canonicalise_countries(frame)["Country"].astype(object).to_numpy()
+    for key in keys:
+        columns.setdefault(key, stats[key].to_numpy())
+    values = stats.drop(columns=list(keys))
+    values.index = (pd.Index(list(zip(*(columns[key] for key in keys))), tupleize_cols=False)
+                    if len(keys) > 1 else pd.Index(columns[keys[0]], dtype=object))
+    values.columns = pd.MultiIndex.from_tuples([tuple(column.split(":")) for column in values.columns])
+    if values.index.has_duplicates:
+        how = {column: COMBINE[column[1]] for column in values.columns}
+        values = values.groupby(level=0, sort=False).agg(how)
+    return values
+
+
+class ParquetSource(object):
+    """Normalised Country/Year queries over Parquet files, pushed down into the scan.
+
+    `path` is a Parquet file or a folder of them, normalised (see `convert_csv`) or raw
+    (the life expectancy column is renamed in the scan). `engine` is "arrow" or "duckdb"
+    (default: DuckDB if installed). `threads` caps the scan threads (default: all CPUs).
+    """
+
+    def __init__(self, path, engine=None, threads=None):
+        if ds is None:
+            raise ImportError("The query backend needs pyarrow")
+        if engine is None:
+            engine = "duckdb" if duckdb is not None else "arrow"
+        if engine not in ENGINES:
+            raise ValueError("Unknown query engine %r (choose from %s)" % (engine, ", ".join(ENGINES)))
+        if engine == "duckdb" and duckdb is None:
+            raise ImportError("The duckdb query engine needs the duckdb package")
+        self.path = path
+        self.engine = engine
+        self.threads = threads
+        self.dataset = ds.dataset(path, format="parquet")
+        self.names = set(self.dataset.schema.names)
+
+    def column(self, measure):
+        """The stored column holding `measure` and the divisor to apply to it."""
+        if measure in self.names:
+            return measure, 1
+        if measure == "LEABY" and LEABY_COLUMN in self.names:
+            return LEABY_COLUMN, 1
+        if measure in SCALED_MEASURES:
+            stored, scale = SCALED_MEASURES[measure]
+            column, divisor = self.column(stored)
+            return column, divisor * scale
+        raise KeyError("%s has no column for %r" % (self.path, measure))
+
+    def predicate(self, countries=None, years=None):
+        """Scanner filter: Country in `countries` (any spelling), Year in [first, last] of `years`.
+
+        Countries are compared trimmed and lower-cased, as `canonicalise_countries` matches them,
+        so a filtered scan keeps every row an unfiltered one maps to `countries`.
+        """
+        condition = None
+        if countries is not None:
+            country = pc.utf8_lower(pc.utf8_trim_whitespace(ds.field("Country")))
+            condition = country.isin(spelling_keys(countries))
+        if years is not None:
+            first, last = years
+            in_years = (ds.field("Year") >= first) & (ds.field("Year") <= last)
+            condition = in_years if condition is None else condition & in_years
+        return condition
+
+    def scan(self, measures=(), countries=None, years=None, batch_size=1 << 20):
+        """Yield the matching rows batch by batch: Country (categorical, canonical), Year, `measures`."""
+        projection = {"Country": ds.field("Country"), "Year": ds.field("Year")}
+        for measure in measures:
+            column, scale = self.column(measure)
+            values = ds.field(column).cast(pa.float64())
+            projection[measure] = pc.divide(values, scale) if scale != 1 else values
+        scanner = self.dataset.scanner(columns=projection, filter=self.predicate(countries, years),
+                                       batch_size=batch_size, use_threads=self.threads != 1)
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield canonicalise_countries(batch.to_pandas(categories=["Country"]))
+
+    def count_rows(self, countries=None, years=None):
+        return self.dataset.count_rows(filter=self.predicate(countries, years))
+
+    def sql_filter(self, countries=None, years=None):
+        """WHERE clause and parameters equivalent to `predicate`, for DuckDB."""
+        clauses, parameters = [], []
+        if countries is not None:
+            clauses.append("lower(trim(Country)) IN (SELECT unnest(?))")
+            parameters.append(spelling_keys(countries))
+        if years is not None:
+            clauses.append("Year BETWEEN ? AND ?")
+            parameters.extend(int(year) for year in years)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), parameters
+
+    def sql(self, query, parameters=()):
+        """Run `query` in DuckDB over the dataset (as the `data` view); returns a pandas frame."""
+        connection = duckdb.connect()
+        try:
+            if self.threads:
+                connection.execute("SET threads TO %d" % self.threads)
+            files = ", ".join("'%s'" % name.replace("'", "''") for name in self.dataset.files)
+            connection.execute("CREATE VIEW data AS SELECT * FROM read_parquet([%s])" % files)
+            return connection.execute(query, list(parameters)).fetchdf()
+        finally:
+            connection.close()
+
+    def distinct(self, column, countries=None, years=None):
+        """Sorted distinct values of "Country" (canonical names) or "Year" among the matching rows."""
+        if self.engine == "duckdb":
+            where, parameters = self.sql_filter(countries, years)
+            values = self.sql('SELECT DISTINCT "%s" AS value FROM data%s' % (column, where), parameters)["value"]
+        else:
+            seen = set()
+            for batch in self.dataset.scanner(columns=[column], filter=self.predicate(countries, years),
+                                              use_threads=self.threads != 1).to_batches():
+                seen.update(pc.unique(batch.column(0)).to_pylist())
+            values = pd.Series(sorted(seen), dtype=object)
+        if column == "Country":
+            frame = canonicalise_countries(pd.DataFrame({"Country": pd.Categorical(values.astype(object))}))
+            return np.asarray(sorted(frame["Country"].cat.categories), dtype=object)
+        return np.sort(values.to_numpy())
+
+    def years(self, countries=None):
+        """Years represented (Step 3), read from the Year column only."""
+        return self.distinct("Year", countries=countries)
+
+    def countries(self, years=None):
+        """Countries represented (Step 3), canonical names."""
+        return self.distinct("Country", years=years)
+
+    def aggregates(self, keys=("Country",), measures=("GDPinTrillions", "LEABY"), countries=None, years=None):
+        """`streaming.RunningAggregates` of the matching rows, grouped by `keys`."""
+        keys, measures = list(keys), list(measures)
+        aggregates = RunningAggregates(keys, measures)
+        if self.engine == "duckdb":
+            where, parameters = self.sql_filter(countries, years)
+            selects = []
+            for measure in measures:
+                column, scale = self.column(measure)
+                value = '(CAST("%s" AS DOUBLE)%s)' % (column, " / %r" % float(scale) if scale != 1 else "")
+                selects += ['count(%s) AS "%s:count"' % (value, measure),
+                            'sum(%s) AS "%s:sum"' % (value, measure),
+                            'sum(%s * %s) AS "%s:sumsq"' % (value, value, measure),
+                            'min(%s) AS "%s:min"' % (value, measure),
+                            'max(%s) AS "%s:max"' % (value, measure)]
+            group = ", ".join(keys)
+            stats = self.sql("SELECT %s, %s FROM data%s GROUP BY %s" % (group, ", ".join(selects), where, group),
+                             parameters)
+            aggregates.stats = canonical_groups(stats, keys)[[(m, s) for m in measures for s in STATISTICS]]
+            return aggregates
+        for chunk in self.scan(measures, countries, years):
+            aggregates.update(chunk)
+        if aggregates.stats is None:
+            raise ValueError("No rows of %s match the query" % self.path)
+        return aggregates
+
+    def summary(self, keys=("Country",), measures=("GDPinTrillions", "LEABY"), countries=None, years=None):
+        """Mean/std/CI/min/max per group (the layout of `summary.summarise`, normal-approximation CI)."""
+        return self.aggregates(keys, measures, countries, years).summary()
+
+    def panel(self, measures=("GDP", "LEABY"), countries=None, years=None):
+        """`panel.Panel` of the mean of each measure per Country and Year.
+
+        With one row per country-year (as in all_data.csv) the means are the values, so the
+        figures can be drawn from it. Its size is countries x years, whatever the row count.
+        Duplicate rows are averaged the same way `Panel.from_long` averages them.
+        """
+        stats = self.aggregates(["Country", "Year"], measures, countries, years).stats
+        keys = np.array(list(stats.index), dtype=object)
+        long = pd.DataFrame({"Country": pd.Categorical(keys[:, 0]), "Year": keys[:, 1].astype(np.int64)})
+        for measure in measures:
+            long[measure] = (stats[(measure, "sum")] / stats[(measure, "count")]).to_numpy()
+        panel_measures = list(measures) + [name for name, (column, _) in SCALED_MEASURES.items()
+                                           if column in measures and name not in measures]
+        return Panel.from_long(long, measures=panel_measures)
+
+
+def open_source(path, engine=None, threads=None):
+    """`ParquetSource` for a Parquet file/folder, or for a Parquet copy of a CSV."""
+    if path.lower().endswith(".csv"):
+        path = parquet_copy(path)
+    return ParquetSource(path, engine, threads)
@@ -0,0 +1,101 @@
+# coding: utf-8
+
+# # Batch figure renderer
+#
+# Step 12 built each blog-post figure by hand: `plt.subplots`, a seaborn call, `plt.savefig`
+# and a blocking `plt.show()`, with `sns.set_context` changing global state in between.
+# Here each figure is declared as a `FigureSpec` (see specs.py) and `render_specs` draws the
+# specs headless on Agg canvases, in a process pool (see drawing.py). The pool's workers read
+# the figure data from one shared-memory copy instead of a pickle each (see shared.py).
+#
+# matplotlib, seaborn and the Agg canvas take most of the script's start-up time, so they are
+# only imported once a figure actually has to be drawn: statistics-only runs and runs where
+# every figure comes from the figure cache never load them.
+
+import importlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from figure_cache import figure_key
+from shared import SharedData
+from specs import paged, summary_key, variant_paths
+
+
+# Names served from drawing.py on first use (`from render import render_figure` still works)
+DRAWING = ["draw", "style_scope", "render_figure", "render_spec", "render_batch"]
+
+
+def __getattr__(name):
+    if name in DRAWING:
+        return getattr(importlib.import_module("drawing"), name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def batches(specs, n):
+    """Split `specs` into at most `n` batches of similar size.
+
+    Specs drawing the same summary (see `specs.summary_key`) go in the same batch, so that
+    summary is computed by one process only.
+    """
+    groups = {}
+    for spec in specs:
+        key = summary_key(spec)
+        groups.setdefault(spec if key is None else key, []).append(spec)
+    split = [[] for _ in range(n)]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        min(split, key=len).extend(group)
+    return [batch for batch in split if batch]
+
+
+def render_specs(specs, df, out_dir=".", processes=None, cache=None, formats=(), writer_threads=2,
+                 queue_depth=4, exports=None, summaries=None):
+    """Render every spec headless and return the saved paths, in spec order.
+
+    `df` is a long-format frame like `df2` or a `panel.Panel`; worker processes attach to a
+    read-only shared-memory copy of it.
+    Figures are drawn on Agg canvases whatever the pyplot backend is, and never shown.
+    `processes=1` renders in this process. With a `figure_cache.FigureCache`, figures whose
+    data, spec, plotting code and library versions are unchanged are not rendered again.
+    `formats` adds copies in other formats (e.g. ("svg", "pdf")). In each process, files are
+    encoded and written by `writer_threads` threads with at most `queue_depth` figures
+    waiting (see export.py); a list passed as `exports` gets the size and save time of each
+    file written. Bar and line figures whose summary is in `summaries` (a
+    `summary.Summaries`, e.g. from the streaming reader) draw from it. Small multiples with
+    `panels_per_page` are saved one file per page (see `specs.paged`).
+    """
+    specs = paged(specs, df)
+    paths = [os.path.join(out_dir, spec.filename) for spec in specs]
+    outputs = [variant_paths(path, formats) for path in paths]
+    todo = list(range(len(specs)))
+    if cache is not None:
+        keys = [figure_key(spec, df, summaries) for spec in specs]
+        todo = [i for i in todo if not all(cache.fetch(keys[i], output) for output in outputs[i])]
+    if not todo:
+        return paths
+
+    pending = [specs[i] for i in todo]
+    drawing = importlib.import_module("drawing")
+    if processes is None:
+        processes = min(len(pending), os.cpu_count() or 1)
+    if processes <= 1:
+        drawing.render_batch(pending, df, out_dir, formats, writer_threads, queue_depth, exports, summaries)
+    else:
+        # One batch per process, each with its own writer threads and summaries
+        split = batches(pending, processes)
+        # The platform's default start method: the workers only need the shared data handle
+        with SharedData.publish(df) as shared, ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context(),
+                initializer=drawing._init_worker, initargs=(shared.handle, summaries)) as pool:
+            n = len(split)
+            written = pool.map(drawing._render_batch_in_worker, split, [out_dir] * n, [formats] * n,
+                               [writer_threads] * n, [queue_depth] * n)
+            for records in written:
+                if exports is not None:
+                    exports.extend(records)
+
+    if cache is not None:
+        for i in todo:
+            for output in outputs[i]:
+                cache.store(keys[i], output)
+    return paths
@@ -0,0 +1,180 @@
+# coding: utf-8
+
+# # Shared-memory data for worker processes
+#
+# render_specs hands the figure data to every worker process of its pool, which is started
+# with the platform's default method. Under spawn and forkserver (the default everywhere but
+# Linux, and on Linux too from Python 3.14) that is one pickle of the whole frame per worker.
+# Under fork the frame is inherited, but each worker's reference counting still writes to,
+# and so copies, the pages of the pandas objects it touches.
+#
+# `SharedData.publish` copies the prepared columns (Country codes, Year, LEABY, GDP ...) or
+# the arrays of a `panel.Panel` once into a single `multiprocessing.shared_memory` segment.
+# What is sent to the workers is its small, picklable `handle`: the segment name, the dtype,
+# shape and offset of each array, and the country names. `attach` maps the segment and
+# rebuilds the frame or panel on read-only NumPy views of it, so fanning out over countries,
+# years or figures serialises nothing. A worker that tries to write to the data gets a
+# ValueError instead of changing what the other workers see.
+#
+# Whether pandas keeps a column as a view is up to pandas. With pandas 2.2 and 3.0 the
+# numeric columns and the Country codes all stay views; string columns other than
+# categoricals are rebuilt, and so copied, in each worker. `Attached.copied` lists the
+# columns the installed pandas copied: those are ordinary writable per-worker arrays
+# (for the Country codes, one small integer per row).
+#
+# The process that published a segment owns it and unlinks it: on `close`, when its `with`
+# block ends, or at the latest when the interpreter exits. Workers only unmap it.
+
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from panel import Panel
+
+
+ALIGN = 64  # every array starts on a cache line
+INDEX = "__index__"  # where a frame's index is stored if it isn't the default RangeIndex
+
+
+def _layout(arrays):
+    """{name: (dtype, shape, offset)} for `arrays` packed into one buffer, and its size."""
+    layout, size = {}, 0
+    for name, array in arrays.items():
+        size = -(-size // ALIGN) * ALIGN
+        layout[name] = (array.dtype.str, array.shape, size)
+        size += array.nbytes
+    return layout, size
+
+
+def _view(buffer, dtype, shape, offset):
+    view = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+    view.flags.writeable = False
+    return view
+
+
+def _frame_arrays(df, columns):
+    """The arrays of the frame's columns (categoricals as their codes) and how to rebuild them."""
+    arrays, columns_meta = {}, []
+    for column in columns:
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            arrays[column] = series.cat.codes.to_numpy()
+            columns_meta.append((column, "category", list(series.cat.categories), series.cat.ordered))
+        elif series.dtype.kind in "biuf":
+            arrays[column] = series.to_numpy()
+            columns_meta.append((column, "values", None, None))
+        else:
+            # Strings and other objects: stored as codes, rebuilt (and so copied) in each worker
+            codes, uniques = pd.factorize(series, use_na_sentinel=True)
+            arrays[column] = codes
+            columns_meta.append((column, str(series.dtype), list(uniques), None))
+    shared_index = not df.index.equals(pd.RangeIndex(len(df)))
+    if shared_index:
+        arrays[INDEX] = df.index.to_numpy()
+    return arrays, {"kind": "frame", "columns": columns_meta, "index": shared_index, "rows": len(df)}
+
+
+def _column_array(series):
+    """The array behind a column (a categorical's codes)."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.array.codes
+    return series.to_numpy()
+
+
+def _build_frame(views, meta):
+    index = pd.Index(views[INDEX]) if meta["index"] else pd.RangeIndex(meta["rows"])
+    columns = {}
+    for column, kind, categories, ordered in meta["columns"]:
+        codes = views[column]
+        if kind == "values":
+            columns[column] = codes
+        elif kind == "category":
+            columns[column] = pd.Categorical.from_codes(
+                codes, dtype=pd.CategoricalDtype(categories, ordered=ordered), validate=False)
+        else:
+            columns[column] = pd.Series(pd.Categorical.from_codes(codes, categories).astype(kind),
+                                        index=index, dtype=kind)
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+class SharedData(object):
+    """A frame or panel published to shared memory, owned (and unlinked) by this process.
+
+    Send `handle` to the workers and `attach` it there. Use it as a context manager, or
+    `close` it, once the workers are done.
+    """
+
+    def __init__(self, arrays, meta):
+        layout, size = _layout(arrays)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        # Unlink even if close is never called (garbage collection or interpreter exit)
+        self._finalizer = weakref.finalize(self, _release, self.memory, True)
+        for name, array in arrays.items():
+            np.ndarray(array.shape, dtype=array.dtype, buffer=self.memory.buf,
+                       offset=layout[name][2])[...] = array
+        self.handle = {"name": self.memory.name, "layout": layout, "meta": meta}
+        self.nbytes = size
+
+    @classmethod
+    def publish(cls, data, columns=None):
+        """Copy `data` into a new shared segment.
+
+        `data` is a long-format frame like `df2` (all columns, or just `columns`) or a
+        `panel.Panel`. Numeric columns are shared as they are, categoricals as their codes.
+        """
+        if isinstance(data, Panel):
+            meta = {"kind": "panel", "countries": list(data.countries), "first_year": data.first_year}
+            return cls({measure: np.ascontiguousarray(array) for measure, array in data.arrays.items()}, meta)
+        return cls(*_frame_arrays(data, list(data.columns) if columns is None else list(columns)))
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def close(self):
+        """Unmap and unlink the segment; workers that attached keep their mapping until they exit."""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _release(memory, unlink):
+    memory.close()
+    if unlink:
+        try:
+            memory.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class Attached(object):
+    """A worker's read-only mapping of a published segment; `data` is the frame or panel."""
+
+    def __init__(self, handle):
+        self.memory = shared_memory.SharedMemory(name=handle["name"])
+        self.arrays = {name: _view(self.memory.buf, *layout) for name, layout in handle["layout"].items()}
+        meta = handle["meta"]
+        if meta["kind"] == "panel":
+            self.data = Panel(np.asarray(meta["countries"], dtype=object), meta["first_year"], self.arrays)
+            self.copied = [measure for measure, array in self.data.arrays.items()
+                           if not np.shares_memory(array, self.arrays[measure])]
+        else:
+            self.data = _build_frame(self.arrays, meta)
+            self.copied = [column for column in self.data.columns
+                           if not np.shares_memory(_column_array(self.data[column]), self.arrays[column])]
+
+    def close(self):
+        """Unmap the segment. Drop every reference to `data` and its arrays first."""
+        self.data = self.arrays = None
+        _release(self.memory, False)
+
+
+def attach(handle):
+    """Map the segment of a `SharedData.handle` in this process."""
+    return Attached(handle)
@@ -0,0 +1,143 @@
+# coding: utf-8
+
+# # Figure specs
+#
+# Each figure is declared as a `FigureSpec`: plot type, columns, labels, ylim, style and rc
+# overrides. This module only describes figures and the data they read, so the entry
+# point can declare every figure without importing matplotlib or seaborn; drawing is in
+# drawing.py.
+
+import dataclasses
+import os
+
+from compact import SCALED_MEASURES
+from panel import Panel
+
+
+@dataclasses.dataclass(frozen=True)
+class FigureSpec(object):
+    """Everything needed to draw and save one figure."""
+
+    filename: str
+    kind: str  # "bar", "grouped_bar", "line" or "violin"; "line" or "scatter" with `facet`
+    y: str
+    x: str = "Country"
+    hue: str = None
+    xlabel: str = None
+    ylabel: str = None
+    title: str = None
+    ylim: tuple = None
+    zoom: tuple = None  # line plots without a ylim: fit the y axis to these hue levels' lines
+    figsize: tuple = (9, 6)
+    palette: str = "Set1"
+    style: str = "ticks"
+    context: str = "talk"
+    rc: tuple = ()  # (name, value) pairs, kept as a tuple so the spec stays hashable
+    legend: tuple = ()  # keyword pairs for ax.legend, e.g. (("loc", "center left"),)
+    countries: tuple = None  # subset of countries to plot, None for all
+    facet: str = None  # small multiples: one panel per level of this column (see facets.py)
+    col_wrap: int = 4
+    height: float = 2
+    color: str = None
+    downsample: bool = False  # line plots: min/max bucketing to the figure's pixel width
+    raster: str = None  # small multiples: "points" or "density" rasterises the data layer (see facets.py)
+    panels_per_page: int = None  # small multiples: split the panels over pages of this many (see `paged`)
+    page: int = None  # the page of a split spec this one draws, from 1
+
+
+def for_countries(specs, countries, suffix):
+    """Copies of `specs` restricted to `countries`, with `suffix` added to each file name."""
+    renamed = []
+    for spec in specs:
+        stem, ext = os.path.splitext(spec.filename)
+        renamed.append(dataclasses.replace(
+            spec, filename="%s_%s%s" % (stem, suffix, ext), countries=tuple(countries)))
+    return renamed
+
+
+def rasterised(specs, raster):
+    """Copies of `specs` with their small multiples drawn in `raster` mode (None for vectors)."""
+    return [dataclasses.replace(spec, raster=raster) if spec.facet is not None else spec for spec in specs]
+
+
+def paginated(specs, panels_per_page):
+    """Copies of `specs` with their small multiples split over pages of `panels_per_page` panels."""
+    return [dataclasses.replace(spec, panels_per_page=panels_per_page) if spec.facet is not None else spec
+            for spec in specs]
+
+
+def page_filename(filename, page):
+    """`<stem>_p<nn><ext>`: the file of one page of a split figure."""
+    stem, ext = os.path.splitext(filename)
+    return "%s_p%02d%s" % (stem, page, ext)
+
+
+def paged(specs, df):
+    """`specs` with each split small multiple replaced by one spec per page of it.
+
+    The number of pages follows from the facet levels in the spec's data (`df`, a long-format
+    frame or a `panel.Panel`); page specs save to `page_filename`.
+    """
+    expanded = []
+    for spec in specs:
+        if spec.facet is None or not spec.panels_per_page or spec.page is not None:
+            expanded.append(spec)
+            continue
+        n_pages = max(1, -(-spec_data(spec, df)[spec.facet].nunique() // spec.panels_per_page))
+        expanded += [dataclasses.replace(spec, filename=page_filename(spec.filename, page), page=page)
+                     for page in range(1, n_pages + 1)]
+    return expanded
+
+
+def for_indicator(specs, measure, indicator, label=None):
+    """Copies of the `specs` that plot `measure`, plotting `indicator` in its place.
+
+    The axis gets `label`, the y limits and title (which name `measure`) are dropped (a spec
+    with a `zoom` then fits the y axis to those lines of `indicator`), and `measure` (or the
+    column it is stored in) is replaced by `indicator` in the file name.
+    """
+    tokens = {measure, SCALED_MEASURES.get(measure, (measure,))[0]}
+    swapped = []
+    for spec in specs:
+        if measure not in (spec.x, spec.y):
+            continue
+        changes = {"title": None}
+        if spec.x == measure:
+            changes.update(x=indicator, xlabel=label)
+        if spec.y == measure:
+            changes.update(y=indicator, ylabel=label, ylim=None)
+        stem, ext = os.path.splitext(spec.filename)
+        parts = stem.split("_")
+        renamed = [indicator if part in tokens else part for part in parts]
+        if renamed == parts:
+            renamed.append(indicator)
+        swapped.append(dataclasses.replace(spec, filename="_".join(renamed) + ext, **changes))
+    return swapped
+
+
+def spec_data(spec, df):
+    """The rows of `df` a spec draws from. `df` may also be a `panel.Panel`."""
+    if isinstance(df, Panel):
+        # Just the measures the spec plots, so rows another indicator adds are left out
+        measures = [column for column in (spec.x, spec.y) if column in df]
+        return df.to_long(countries=spec.countries, measures=measures or None)
+    if spec.countries is None:
+        return df
+    return df[df["Country"].isin(spec.countries)]
+
+
+def summary_key(spec):
+    """(countries, group-by columns, measure) of the summary a bar or line spec draws; None otherwise.
+
+    Specs with the same key draw from the same `summary.Summaries` entry.
+    """
+    if spec.facet is not None:
+        return None
+    by = {"bar": (spec.x,), "grouped_bar": (spec.x, spec.hue), "line": (spec.hue, spec.x)}.get(spec.kind)
+    return None if by is None else (spec.countries, by, spec.y)
+
+
+def variant_paths(path, formats):
+    """`path` plus one path per extra format in `formats` (e.g. ("svg", "pdf"))."""
+    stem, ext = os.path.splitext(path)
+    return [path] + [stem + "." + fmt for fmt in formats if "." + fmt != ext]
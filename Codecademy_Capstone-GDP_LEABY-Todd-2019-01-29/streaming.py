@@ -0,0 +1,168 @@
+# coding: utf-8
+
+# # Streaming ingestion
+#
+# The notebook steps keep `df`, `df2` (from the replace) and the widened `df2` (with
+# GDPinTrillions) alive at the same time. For panels that don't fit in RAM, this module
+# reads the CSV in chunks, applies the same rename/normalise/derive steps to each chunk,
+# and folds it into running per-group aggregates. Only the aggregates are kept, so peak
+# memory scales with the number of groups rather than the number of rows.
+#
+# `--stream` runs the pipeline this way: the summary tables and the bar and line figures come
+# from the streamed summaries, and the correlations, changes and the figures that plot
+# country-years (violins, small multiples) read the (Country x Year) panel of the per
+# Country/Year means (`summary_panel`).
+
+import numpy as np
+import pandas as pd
+
+from countries import canonicalise_countries
+from data_loader import LEABY_COLUMN, read_typed_csv
+from panel import Panel
+
+
+# Measures the plots need statistics for
+MEASURES = ["LEABY", "GDP", "GDPinTrillions"]
+
+# Groupings used by the plots: per Country (bar/violin) and per Country and Year (lines)
+GROUPINGS = [("Country",), ("Country", "Year")]
+
+# Running statistics kept per group and measure
+STATISTICS = ["count", "sum", "sumsq", "min", "max"]
+COMBINE = {"count": "sum", "sum": "sum", "sumsq": "sum", "min": "min", "max": "max"}
+
+
+def prepare_chunk(chunk, scaled=True):
+    """Apply the notebook's Step 4/5 rename, normalise and derive steps to one chunk.
+
+    `scaled=False` leaves out GDPinTrillions (compact frames derive it on read, see compact.py).
+    """
+    # Step 4: rename the long life expectancy column
+    chunk = chunk.rename(columns={LEABY_COLUMN: "LEABY"})
+
+    # Step 5: canonical country names ("USA" etc.) and GDP in trillions
+    canonicalise_countries(chunk)
+    if scaled:
+        chunk["GDPinTrillions"] = chunk["GDP"] / 1e12
+    return chunk
+
+
+def iter_chunks(path, chunksize=1000000):
+    """Yield prepared chunks of `path`, `chunksize` rows at a time."""
+    with read_typed_csv(path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield prepare_chunk(chunk)
+
+
+class RunningAggregates(object):
+    """Count, sum, sum of squares, min and max per group, folded in chunk by chunk."""
+
+    def __init__(self, keys, measures=MEASURES):
+        self.keys = list(keys)
+        self.measures = list(measures)
+        self.stats = None
+
+    def update(self, chunk):
+        """Fold one chunk into the running statistics. Costs O(groups), not O(rows seen)."""
+        values = chunk[self.keys + self.measures].copy()
+        for measure in self.measures:
+            values[measure] = values[measure].astype(np.float64)
+            values[measure + "_sq"] = values[measure] ** 2
+        grouped = values.groupby(self.keys, observed=True, sort=False)
+
+        # One grouped pass gives every statistic for every measure
+        parts = {}
+        for measure in self.measures:
+            parts[(measure, "count")] = grouped[measure].count()
+            parts[(measure, "sum")] = grouped[measure].sum()
+            parts[(measure, "sumsq")] = grouped[measure + "_sq"].sum()
+            parts[(measure, "min")] = grouped[measure].min()
+            parts[(measure, "max")] = grouped[measure].max()
+        stats = pd.DataFrame(parts)
+        stats.columns = pd.MultiIndex.from_tuples(stats.columns)
+        stats.index = stats.index.to_flat_index() if len(self.keys) > 1 else stats.index.astype(object)
+        self.merge(stats)
+        return self
+
+    def merge(self, stats):
+        """Combine already-aggregated statistics (same layout as `self.stats`) into this one."""
+        if self.stats is None:
+            self.stats = stats
+            return self
+        combined = pd.concat([self.stats, stats])
+        how = {column: COMBINE[column[1]] for column in combined.columns}
+        self.stats = combined.groupby(level=0, sort=False).agg(how)
+        return self
+
+    def save(self, path):
+        """Write the running statistics to a CSV (one row per group)."""
+        flat = self.stats.copy()
+        flat.columns = ["%s:%s" % column for column in flat.columns]
+        keys = pd.DataFrame(list(flat.index) if len(self.keys) > 1 else {self.keys[0]: flat.index},
+                            columns=self.keys)
+        pd.concat([keys, flat.reset_index(drop=True)], axis=1).to_csv(path, index=False)
+
+    @classmethod
+    def load(cls, path, keys, measures=MEASURES):
+        """Read statistics written by `save`."""
+        aggregates = cls(keys, measures)
+        # round_trip: the sums of squares must come back bit for bit to keep std exact
+        flat = pd.read_csv(path, float_precision="round_trip")
+        stats = flat.drop(columns=aggregates.keys)
+        stats.columns = pd.MultiIndex.from_tuples([tuple(column.split(":")) for column in stats.columns])
+        if len(aggregates.keys) > 1:
+            stats.index = pd.Index(list(zip(*(flat[key] for key in aggregates.keys))), tupleize_cols=False)
+        else:
+            stats.index = pd.Index(flat[aggregates.keys[0]], dtype=object)
+        aggregates.stats = stats
+        return aggregates
+
+    def summary(self, z=1.96):
+        """Mean, std, standard error, normal-approximation CI, min and max per group."""
+        frames = {}
+        for measure in self.measures:
+            stats = self.stats[measure]
+            count = stats["count"]
+            mean = stats["sum"] / count
+            # Sample variance from the running sums (clipped at 0 against rounding)
+            var = ((stats["sumsq"] - count * mean ** 2) / (count - 1)).clip(lower=0)
+            std = np.sqrt(var)
+            sem = std / np.sqrt(count)
+            frames[measure] = pd.DataFrame({
+                "count": count,
+                "mean": mean,
+                "std": std,
+                "sem": sem,
+                "ci_low": mean - z * sem,
+                "ci_high": mean + z * sem,
+                "min": stats["min"],
+                "max": stats["max"],
+            })
+        result = pd.concat(frames, axis=1).sort_index()
+        if len(self.keys) > 1:
+            result.index = pd.MultiIndex.from_tuples(result.index, names=self.keys)
+        else:
+            result.index.name = self.keys[0]
+        return result
+
+
+def stream_aggregates(path, chunksize=1000000, groupings=GROUPINGS, measures=MEASURES):
+    """Stream `path` in chunks and return {grouping: summary frame} for each grouping."""
+    aggregates = {keys: RunningAggregates(keys, measures) for keys in groupings}
+    rows = 0
+    for chunk in iter_chunks(path, chunksize):
+        rows += len(chunk)
+        for aggregate in aggregates.values():
+            aggregate.update(chunk)
+    if not rows:
+        raise ValueError("%s has no data rows" % path)
+    return {keys: aggregate.summary() for keys, aggregate in aggregates.items()}
+
+
+def summary_panel(summary, measures=MEASURES):
+    """`panel.Panel` of the means of a ("Country", "Year") summary.
+
+    With one row per country-year (as in all_data.csv) the means are the values.
+    """
+    means = summary.xs("mean", axis=1, level=1).reset_index()
+    return Panel.from_long(means, measures=[measure for measure in measures if measure in means])
@@ -0,0 +1,157 @@
+# coding: utf-8
+
+# # Summary engine
+#
+# Every `sns.barplot`/`sns.lineplot` call recomputed the means and bootstrapped confidence
+# intervals (1000 resamples per group) from the raw rows, and that is most of the render time.
+# `summarise` computes count, mean, std, min, max and a bootstrap CI for every group and
+# measure in one grouped pass. The plots draw from its output (see plots.py).
+#
+# The result has the same layout as `streaming.RunningAggregates.summary()`:
+# one row per group, columns `(measure, statistic)`. `Summaries` keeps the summaries of a
+# render batch, so figures drawing the same groups and measure (Figure C and its inset)
+# bootstrap them once.
+
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from compact import measure_values
+
+
+# Cap on the number of resampled values held at once while bootstrapping
+BOOTSTRAP_BLOCK = 1 << 22
+
+
+def group_codes(df, by):
+    """Integer group code per row (-1 for a missing key), plus the index of group keys (sorted)."""
+    if len(by) == 1 and isinstance(df[by[0]].dtype, pd.CategoricalDtype):
+        # One categorical key: its codes already are group codes, minus unused categories
+        column = df[by[0]]
+        codes = column.cat.codes.to_numpy(dtype=np.intp)
+        used = np.bincount(codes[codes >= 0], minlength=len(column.cat.categories)) > 0
+        renumber = np.append(np.cumsum(used) - 1, -1)  # code -1 stays -1
+        return renumber[codes], pd.Index(column.cat.categories[used], name=by[0])
+    grouped = df.groupby(list(by), observed=True, sort=True)
+    codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.intp)
+    index = grouped.size().index
+    return codes, index
+
+
+def bootstrap_means(values, codes, n_groups, n_boot, rng):
+    """Bootstrap the mean of each group: array of shape (n_boot, n_groups).
+
+    All groups are resampled at once. Rows are sorted by group, and each resample
+    draws, for every row, a random row of the same group (`start + floor(u * size)`).
+    The per-group sums are then `np.add.reduceat` over the group boundaries.
+    """
+    order = np.argsort(codes, kind="stable")
+    values = values[order]
+    codes = codes[order]
+    sizes = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    present = sizes > 0
+
+    row_start = starts[codes]
+    row_size = sizes[codes]
+    boot = np.full((n_boot, n_groups), np.nan)
+    block = max(1, BOOTSTRAP_BLOCK // max(1, len(values)))
+    for first in range(0, n_boot, block):
+        count = min(block, n_boot - first)
+        picks = row_start + (rng.random((count, len(values))) * row_size).astype(np.intp)
+        sums = np.add.reduceat(values[picks], starts[present], axis=1)
+        boot[first:first + count, present] = sums / sizes[present]
+    return boot
+
+
+def summarise(df, by, measures, n_boot=1000, ci=95, seed=0):
+    """Per-group count, mean, std, sem, bootstrap CI, min and max for each measure.
+
+    `by` is a list of grouping columns, e.g. ["Country"] or ["Country", "Year"].
+    NaNs are left out per measure, like seaborn does. Groups with a single row
+    get a NaN CI (seaborn draws no error bar for them either). `n_boot=0` skips
+    the bootstrap and uses the normal approximation instead.
+    """
+    codes, index = group_codes(df, by)
+    n_groups = len(index)
+    rng = np.random.default_rng(seed)
+    tail = (100 - ci) / 2
+
+    frames = {}
+    for measure in measures:
+        values = measure_values(df, measure)
+        valid = ~np.isnan(values) & (codes >= 0)
+        values, measure_codes = values[valid], codes[valid]
+
+        count = np.bincount(measure_codes, minlength=n_groups)
+        total = np.bincount(measure_codes, weights=values, minlength=n_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            deviation = values - mean[measure_codes]
+            var = np.bincount(measure_codes, weights=deviation ** 2, minlength=n_groups) / (count - 1)
+            single = count < 2
+            var[single] = np.nan  # no spread to report, not zero spread
+            std = np.sqrt(var)
+            sem = std / np.sqrt(count)
+
+        minimum = np.full(n_groups, np.nan)
+        maximum = np.full(n_groups, np.nan)
+        np.fmin.at(minimum, measure_codes, values)
+        np.fmax.at(maximum, measure_codes, values)
+
+        if n_boot:
+            boot = bootstrap_means(values, measure_codes, n_groups, n_boot, rng)
+            ci_low = np.full(n_groups, np.nan)
+            ci_high = np.full(n_groups, np.nan)
+            present = count > 0
+            ci_low[present], ci_high[present] = np.percentile(boot[:, present], [tail, 100 - tail], axis=0)
+        else:
+            z = NormalDist().inv_cdf(1 - tail / 100)
+            ci_low, ci_high = mean - z * sem, mean + z * sem
+        ci_low[single] = np.nan
+        ci_high[single] = np.nan
+
+        frames[measure] = pd.DataFrame({
+            "count": count,
+            "mean": mean,
+            "std": std,
+            "sem": sem,
+            "ci_low": ci_low,
+            "ci_high": ci_high,
+            "min": minimum,
+            "max": maximum,
+        }, index=index)
+    return pd.concat(frames, axis=1)
+
+
+
+class Summaries(object):
+    """`summarise` results for one data set, each (countries, by, measure) computed once.
+
+    The key is `specs.summary_key` of the figure: `countries` is None for every country.
+    `tables` (or `add`) supplies summaries computed elsewhere, e.g. by the streaming reader.
+    """
+
+    def __init__(self, n_boot=1000, tables=None):
+        self.n_boot = n_boot
+        self.tables = dict(tables or {})
+
+    def add(self, by, table):
+        """Use `table` (summary layout, every country) for its measures grouped by `by`."""
+        for measure in table.columns.get_level_values(0).unique():
+            self.tables[(None, tuple(by), measure)] = table[[measure]]
+
+    def get(self, key, df):
+        """Summary for `key`, from `df` (the rows of those countries) the first time."""
+        table = self.tables.get(key)
+        if table is None:
+            _, by, measure = key
+            table = self.tables[key] = summarise(df, list(by), [measure], n_boot=self.n_boot)
+        return table
+
+    def __contains__(self, key):
+        return key in self.tables
+
+    def __len__(self):
+        return len(self.tables)
@@ -0,0 +1,106 @@
+# coding: utf-8
+
+# # Figure templates
+#
+# Each figure used to pay for its own set-up: `sns.axes_style`, `sns.plotting_context` and
+# `sns.color_palette` resolved into rc settings again, and a new Figure, canvas and Axes
+# (with every tick, spine and label built from scratch). When the rendered text has to be
+# measured, matplotlib caches the metrics per renderer, so a new canvas also started with an
+# empty text-metrics cache.
+#
+# Here the rc settings of each (style, context, rc, palette) combination are resolved once
+# (`style_rc`). A `FigureTemplate` is one styled figure, canvas and Axes that is reset between
+# uses: only the data artists, labels, limits, ticks and legend are cleared, so the axes,
+# ticks and renderer survive. Tick labels, titles and legends repeat from one figure to the
+# next, so most text measurements then hit the cache of the reused renderer.
+# `Templates` keeps one template per style and figure size.
+
+import functools
+
+from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import seaborn as sns
+
+
+@functools.lru_cache(maxsize=None)
+def style_rc(style, context, rc=(), palette=None):
+    """rc settings of a seaborn style, context (with `rc` overrides) and palette, resolved once.
+
+    Don't modify the returned dict: it is shared by every figure in that style.
+    """
+    params = dict(sns.axes_style(style))
+    params.update(sns.plotting_context(context, rc=dict(rc)))
+    params["axes.prop_cycle"] = plt.cycler(color=sns.color_palette(palette))
+    return params
+
+
+def spec_style(spec):
+    """The `style_rc` key of a figure spec."""
+    return spec.style, spec.context, spec.rc, spec.palette
+
+
+class FigureTemplate(object):
+    """A styled Figure on an Agg canvas with one Axes, reset between uses.
+
+    Build and use it inside its style's `plt.rc_context(style_rc(...))`: the reset reads
+    the rc settings again (colour cycle, grid, tick locators).
+    """
+
+    def __init__(self, figsize):
+        self.fig = Figure(figsize=figsize)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots()
+        self.uses = 0
+
+    def reset(self):
+        """Remove what the last figure drew and put the Axes back as `fig.subplots()` made it."""
+        ax = self.ax
+        for artist in (list(ax.lines) + list(ax.collections) + list(ax.patches) + list(ax.texts)
+                       + list(ax.images) + list(ax.artists) + list(ax.tables)):
+            artist.remove()
+        ax.containers.clear()
+        if ax.get_legend() is not None:
+            ax.get_legend().remove()
+        ax.set_title("")
+        ax.set_xlabel("")
+        ax.set_ylabel("")
+        # Default locators and formatters for the rc settings (drops set_xticks/labels)
+        ax.set_xscale("linear")
+        ax.set_yscale("linear")
+        ax.grid(False, which="both")
+        if plt.rcParams["axes.grid"]:
+            ax.grid(True, which=plt.rcParams["axes.grid.which"], axis=plt.rcParams["axes.grid.axis"])
+        ax.set_prop_cycle(None)
+        ax.relim()
+        ax.autoscale(True)
+        return self
+
+    def use(self):
+        """The figure and Axes, reset if they were used before."""
+        if self.uses:
+            self.reset()
+        self.uses += 1
+        return self.fig, self.ax
+
+
+class Templates(object):
+    """One `FigureTemplate` per style and figure size.
+
+    A template is handed out again by the next `figure` call, so draw or save each figure
+    before asking for the next one (`export.FigureWriter.submit` draws before returning).
+    """
+
+    def __init__(self):
+        self.templates = {}
+
+    def figure(self, spec):
+        """Figure and Axes for `spec`; call inside the spec's style."""
+        key = (spec_style(spec), tuple(spec.figsize))
+        template = self.templates.get(key)
+        if template is None:
+            template = self.templates[key] = FigureTemplate(spec.figsize)
+        return template.use()
+
+    def __len__(self):
+        return len(self.templates)